@@ -0,0 +1,237 @@
+from . import db
+from . import pinboard
+from . import render as render_module
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import time
+
+SIZES = (1000, 10000, 100000, 1000000)
+DEFAULT_SIZES = (1000, 10000, 100000)
+BENCH_PATH = '.cache/bench'
+TEMPLATES = os.path.join(os.path.dirname(__file__), '..', 'templates')
+
+# links span this many years, ending here, whatever their number
+SPAN_YEARS = 20
+END_TS = 1735689600  # 2025-01-01 UTC
+
+WORDS = ('climate hope energy solar grid battery heat pump policy city transit bike '
+         'software database python sqlite latency cache index query render template '
+         'history science fiction novel essay interview book review music art design '
+         'open source community protocol network web browser privacy security data').split()
+
+def lognormal_length(rng, median, cap):
+    return min(cap, max(1, int(rng.lognormvariate(0, 0.7) * median)))
+
+def words(rng, length):
+    text = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        text.append(word)
+        size += len(word) + 1
+    return ' '.join(text)
+
+def generate_links(count, seed=0):
+    """
+    Yield count synthetic links, oldest first, shaped like the real
+    archive: every link tagged mlp plus about five tags drawn from a
+    Zipf-like vocabulary that grows with the archive, ~4% quotable, ~17%
+    with a via (mostly URLs), descriptions around 60 characters and
+    extended text around 160, with a long tail.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f'{rng.choice(WORDS)}-{rank}' for rank in range(max(50, int(20 * count ** 0.5)))]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    cumulative = []
+    total = 0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+
+    start = END_TS - SPAN_YEARS * 365 * 86400
+    step = (END_TS - start) / count
+    for i in range(count):
+        ts = int(start + i * step + rng.uniform(0, step))
+        # a few links are backdated, so ts order isn't insert order
+        if rng.random() < 0.01:
+            ts -= rng.randint(0, 90 * 86400)
+
+        tags = ['mlp'] + rng.choices(vocabulary, cum_weights=cumulative, k=rng.randint(1, 10))
+        if rng.random() < 0.04:
+            tags.append('quotable')
+
+        via = None
+        if rng.random() < 0.17:
+            via = f'https://{rng.choice(WORDS)}.example.org/' if rng.random() < 0.85 else rng.choice(WORDS)
+
+        url = f'https://{rng.choice(WORDS)}.example.com/{i}/{rng.choice(WORDS)}'
+        yield {
+            'ts': ts,
+            'url': url,
+            'description': words(rng, lognormal_length(rng, 60, 200)).capitalize(),
+            'extended': '' if rng.random() < 0.03 else words(rng, lognormal_length(rng, 160, 1000)),
+            'via': via,
+            'tags': ' '.join(dict.fromkeys(tags)),
+            'hash': hashlib.md5(url.encode('utf-8')).hexdigest()
+        }
+
+def make_database(count, seed=0, path=BENCH_PATH):
+    """
+    Path to a database of count synthetic links, generating it through
+    db.insert_links the first time and reusing it after that.
+    """
+    path = os.path.abspath(path)
+    db_path = os.path.join(path, f'links-{count}-{seed}.db')
+    if os.path.exists(db_path):
+        return db_path
+
+    os.makedirs(path, exist_ok=True)
+    partial = db_path + '.partial'
+    if os.path.exists(partial):
+        os.unlink(partial)
+    with use_database(partial):
+        db.insert_links(generate_links(count, seed), batch_size=5000)
+    os.replace(partial, db_path)
+    return db_path
+
+def make_posts_all(count, seed=0, path=BENCH_PATH):
+    """
+    Path to a posts/all JSON response holding count synthetic links,
+    written the first time and reused after that.
+    """
+    path = os.path.abspath(path)
+    posts_path = os.path.join(path, f'posts-all-{count}-{seed}.json')
+    if os.path.exists(posts_path):
+        return posts_path
+
+    os.makedirs(path, exist_ok=True)
+    partial = posts_path + '.partial'
+    with open(partial, 'w', encoding='utf-8') as fp:
+        fp.write('[')
+        for i, link in enumerate(generate_links(count, seed)):
+            tags = link['tags'] if link['via'] is None else f"{link['tags']} via:{link['via']}"
+            post = {'href': link['url'], 'description': link['description'], 'extended': link['extended'],
+                    'meta': link['hash'], 'hash': link['hash'], 'time': pinboard.unix_to_iso(link['ts']),
+                    'shared': 'yes', 'toread': 'no', 'tags': tags}
+            fp.write((',\n' if i else '') + json.dumps(post, ensure_ascii=False))
+        fp.write(']')
+    os.replace(partial, posts_path)
+    return posts_path
+
+def decode_posts_all(posts_path):
+    """Decode a posts/all response into link dicts, as a sync does before writing them."""
+    with open(posts_path, 'rb') as fp:
+        return sum(1 for _ in pinboard.iter_posts(fp))
+
+class use_database:
+    """Point db.module() at the database at path for the duration."""
+
+    def __init__(self, path):
+        self.url = f'sqlite:///{path}'
+
+    def __enter__(self):
+        self.saved = db.DB_URL
+        db.close()
+        db.DB_URL = self.url
+        return db.module()
+
+    def __exit__(self, *exc):
+        db.close()
+        db.DB_URL = self.saved
+
+def timed(stage, timings, fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - started
+    timings[stage] = min(elapsed, timings.get(stage, elapsed))
+    return result
+
+def bench_prepare_posts(queries, timings, batch_size=10000):
+    """Time prepare_posts over every link, read in untimed batches."""
+    elapsed = 0
+    batch = []
+    for link in db.iter_rows(queries.stream_links()):
+        batch.append(link)
+        if len(batch) == batch_size:
+            started = time.perf_counter()
+            render_module.prepare_posts(batch)
+            elapsed += time.perf_counter() - started
+            batch = []
+    started = time.perf_counter()
+    render_module.prepare_posts(batch)
+    elapsed += time.perf_counter() - started
+    timings['prepare_posts'] = min(elapsed, timings.get('prepare_posts', elapsed))
+
+def run(count, repeat=1, seed=0, path=BENCH_PATH):
+    """
+    Render a database of count synthetic links from scratch repeat times,
+    in a scratch directory under path, and return the fastest time for
+    each stage in seconds.
+    """
+    db_path = make_database(count, seed, path)
+    workdir = os.path.join(os.path.abspath(path), f'site-{count}')
+    os.makedirs(workdir, exist_ok=True)
+    templates = os.path.join(workdir, 'templates')
+    if not os.path.exists(templates):
+        os.symlink(os.path.abspath(TEMPLATES), templates)
+
+    timings = {}
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with use_database(db_path) as queries:
+            for _ in range(repeat):
+                shutil.rmtree('_site', ignore_errors=True)
+                snapshot = timed('load_snapshot', timings, render_module.load_snapshot)
+                timed('create_index', timings, render_module.create_index, snapshot=snapshot)
+                timed('create_archives', timings, render_module.create_archives, snapshot=snapshot)
+                timed('create_tags', timings, render_module.create_tags, snapshot=snapshot)
+                timed('create_feed', timings, render_module.create_feed, snapshot=snapshot)
+                timed('create_recent_json', timings, render_module.create_recent_json, snapshot=snapshot)
+                bench_prepare_posts(queries, timings)
+    finally:
+        os.chdir(cwd)
+
+    posts_path = make_posts_all(count, seed, path)
+    for _ in range(repeat):
+        timed('decode_posts_all', timings, decode_posts_all, posts_path)
+    return timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark rendering and syncing synthetic link databases.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help=f'numbers of links to benchmark (default {" ".join(map(str, DEFAULT_SIZES))}; '
+                             f'up to {SIZES[-1]} is supported)')
+    parser.add_argument('--repeat', type=int, default=3, help='renders per size; the fastest is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=os.path.join(BENCH_PATH, 'results.jsonl'),
+                        help='JSON lines file each run is appended to')
+    args = parser.parse_args(argv)
+
+    record = {
+        'started': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': []
+    }
+    for count in args.sizes:
+        timings = run(count, args.repeat, args.seed)
+        for stage, seconds in timings.items():
+            record['results'].append({'links': count, 'stage': stage, 'seconds': round(seconds, 6)})
+            print(f'{count:>8} {stage:<20} {seconds:9.3f}s')
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'a') as fp:
+        fp.write(json.dumps(record) + '\n')
+    print(f'Appended results to {args.output}')
+
+if __name__ == '__main__':
+    main()
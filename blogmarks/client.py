@@ -0,0 +1,174 @@
+import http.client
+import re
+import threading
+import time
+import urllib.parse
+
+API_URL = 'https://api.pinboard.in/v1/'
+
+# seconds Pinboard asks clients to leave between calls: three for most
+# methods, longer for the expensive ones
+DEFAULT_INTERVAL = 3
+INTERVALS = {'posts/all': 300, 'posts/recent': 60}
+
+# statuses worth trying again; anything else that isn't 200 fails at once
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def redact(text):
+    """text with the value of any auth_token parameter masked."""
+    return re.sub(r'(auth_token=)[^&\s]*', r'\1REDACTED', text)
+
+class PinboardError(Exception):
+    """A call that failed for good, with the token redacted from its message."""
+
+    def __init__(self, message, status=None):
+        super().__init__(redact(message))
+        self.status = status
+
+class RateLimiter:
+    """
+    Waits out Pinboard's rate limits: at least DEFAULT_INTERVAL seconds
+    between any two calls, and the method's entry in intervals between
+    calls to the same method. Pinboard allows no bursts, so this is a token
+    bucket holding one token: each caller reserves the next free slot under
+    a lock and then sleeps until it, so threads sharing a limiter take turns
+    rather than piling onto the API together. Times are wall clock, so
+    state() can be saved and handed to the next run's limiter.
+    """
+
+    def __init__(self, intervals=None, default=DEFAULT_INTERVAL, state=None, clock=time.time, sleep=time.sleep):
+        self.intervals = INTERVALS if intervals is None else intervals
+        self.default = default
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        state = state or {}
+        self.last_call = state.get('last_call')
+        self.last_calls = dict(state.get('methods', {}))
+        self.paused_until = None
+
+    def wait(self, method):
+        with self.lock:
+            now = self.clock()
+            ready = now
+            if self.last_call is not None:
+                ready = max(ready, self.last_call + self.default)
+            if method in self.last_calls:
+                ready = max(ready, self.last_calls[method] + self.intervals.get(method, self.default))
+            if self.paused_until is not None:
+                ready = max(ready, self.paused_until)
+            self.last_call = self.last_calls[method] = ready
+        if ready > now:
+            self.sleep(ready - now)
+
+    def back_off(self, seconds):
+        """Hold every caller back for seconds, after a call failed or Pinboard said to slow down."""
+        with self.lock:
+            self.paused_until = max(self.paused_until or 0, self.clock() + seconds)
+
+    def state(self):
+        with self.lock:
+            return {'last_call': self.last_call, 'methods': dict(self.last_calls)}
+
+class PinboardClient:
+    """
+    Calls the Pinboard API over one persistent connection per thread,
+    reopened when the server or a half-read response drops it. Each call
+    waits its turn under the rate limiter, times out after timeout seconds,
+    and is retried with exponential backoff on connection errors, timeouts,
+    429 and 5xx, up to retries times; the backoff goes through the limiter,
+    so every thread sharing it holds off. Responses are returned unread, so
+    callers can parse them as they arrive; a response failing part way
+    through isn't retried.
+    """
+
+    def __init__(self, token, url=API_URL, timeout=30, retries=4, backoff=2, limiter=None):
+        self.token = token
+        parts = urllib.parse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.netloc
+        self.path = parts.path
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        # each thread keeps its own connection alive
+        self.local = threading.local()
+
+    def connect(self):
+        if getattr(self.local, 'connection', None) is None:
+            connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            self.local.connection = connection_class(self.host, timeout=self.timeout)
+        return self.local.connection
+
+    def reset(self):
+        """Drop this thread's connection; its next call opens a new one."""
+        if getattr(self.local, 'connection', None) is not None:
+            self.local.connection.close()
+            self.local.connection = None
+
+    def url(self, method, params):
+        params = dict(params)
+        if self.token is not None:
+            params.setdefault('auth_token', self.token)
+        return f'{self.path}{method}?{urllib.parse.urlencode(params)}'
+
+    def open(self, method, **params):
+        """Call method and return the response, a file object over its body."""
+        url = self.url(method, params)
+        print(redact(url))
+        for attempt in range(self.retries + 1):
+            self.limiter.wait(method)
+            delay = self.backoff * 2 ** attempt
+            try:
+                connection = self.connect()
+                connection.request('GET', url, headers={'Connection': 'keep-alive'})
+                response = connection.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                # timed out, refused, or a kept-alive connection the server had closed
+                self.reset()
+                error = PinboardError(f'{method} failed: {e!r}')
+            else:
+                if response.status == 200:
+                    return Response(self, response)
+                response.read()
+                error = PinboardError(f'{method} returned {response.status} {response.reason}', response.status)
+                if response.status not in RETRY_STATUSES:
+                    raise error
+                retry_after = response.getheader('Retry-After')
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+            if attempt < self.retries:
+                print(redact(f'{error}, retrying in {delay}s'))
+                self.limiter.back_off(delay)
+        raise error
+
+    def close(self):
+        self.reset()
+
+class Response:
+    """
+    A response body being read. Closing it before the end drops the
+    connection, since the unread rest of the body would otherwise be read
+    as the next response.
+    """
+
+    def __init__(self, client, response):
+        self.client = client
+        self.response = response
+
+    def read(self, size=-1):
+        # HTTPResponse reads to the end of the body only for None; a
+        # negative size would read on to the end of the kept-alive stream
+        return self.response.read(size if size is not None and size >= 0 else None)
+
+    def close(self):
+        if not self.response.isclosed():
+            self.client.reset()
+        self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
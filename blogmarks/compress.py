@@ -0,0 +1,70 @@
+import gzip
+import os
+from . import output
+
+def gzip_compress(data):
+    # mtime=0 so unchanged input always compresses to the same bytes
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+# extension -> function compressing bytes to bytes
+CODECS = {'gz': gzip_compress}
+
+try:
+    import brotli
+    CODECS['br'] = lambda data: brotli.compress(data, quality=11)
+except ImportError:
+    pass
+
+try:
+    import zstandard
+    CODECS['zst'] = lambda data: zstandard.ZstdCompressor(level=19).compress(data)
+except ImportError:
+    pass
+
+# files worth compressing; anything else is served as is
+COMPRESS_SUFFIXES = ('.html', '.atom', '.json', '.xml')
+
+# every extension a sibling may have, including codecs not installed here
+SIBLING_SUFFIXES = ('.gz', '.br', '.zst')
+
+def compress_site(root='_site', codecs=('gz',)):
+    """
+    Write a sibling of every compressible file under root for each codec,
+    e.g. index.html.gz, and remove siblings that are stale, whose file is
+    gone or whose codec wasn't asked for. A sibling is given its source's
+    mtime, so a file that write_file left alone is recognised as already
+    compressed. Returns the number of siblings written.
+    """
+    written = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            if name.endswith(SIBLING_SUFFIXES):
+                source, extension = path.rsplit('.', 1)
+                try:
+                    current = (extension in codecs
+                               and os.stat(path).st_mtime_ns == os.stat(source).st_mtime_ns)
+                except FileNotFoundError:
+                    current = False
+                if not current:
+                    os.unlink(path)
+                continue
+            if name.startswith('.') or not name.endswith(COMPRESS_SUFFIXES):
+                continue
+
+            source = os.stat(path)
+            data = None
+            for extension in codecs:
+                sibling = f'{path}.{extension}'
+                try:
+                    if os.stat(sibling).st_mtime_ns == source.st_mtime_ns:
+                        continue
+                except FileNotFoundError:
+                    pass
+                if data is None:
+                    with open(path, 'rb') as fp:
+                        data = fp.read()
+                output.write_file(sibling, CODECS[extension](data))
+                os.utime(sibling, ns=(source.st_atime_ns, source.st_mtime_ns))
+                written += 1
+    return written
@@ -0,0 +1,9 @@
+import datetime
+
+def format_ts(ts, format="%Y-%m-%d"):
+    return datetime.datetime.fromtimestamp(ts).strftime(format)
+
+def format_ts_rfc3339(ts):
+    """Format a timestamp as a date suitable for inclusion in Atom feeds."""
+    date = datetime.datetime.fromtimestamp(ts)
+    return date.isoformat() + ("Z" if date.utcoffset() is None else "")
@@ -1,18 +1,189 @@
+import os
 import sqlite3
+import threading
+import itertools
 import pugsql, pugsql.compiler
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import SingletonThreadPool
 
-def module():
-    queries = pugsql.module('sql/')
-    queries.connect('sqlite:///data.db')
+# resolved from the package so connecting doesn't depend on the working directory
+SQL_PATH = os.path.join(os.path.dirname(__file__), '..', 'sql')
+DB_URL = 'sqlite:///data.db'
+
+_queries = None
+_lock = threading.Lock()
+
+def connect(url=DB_URL):
+    """
+    Build a new pugsql module bound to url and make sure the schema exists.
+    Most callers want module(), which shares one of these per process.
+    """
+    queries = pugsql.module(SQL_PATH)
+    # one sqlite connection per thread, reused for every statement
+    queries.connect(url, poolclass=SingletonThreadPool)
+    create_schema(queries)
+    return queries
+
+SCHEMA_VERSION = 4
+
+def create_schema(queries):
+    """
+    Create the tables and indexes if they don't exist yet, and bring data
+    in older databases up to SCHEMA_VERSION (tracked in PRAGMA user_version).
+    """
     queries.create_links_tables()
+    # month archives and numbered pages are range scans on ts
+    queries.create_links_ts_index()
+    queries.create_link_tags_table()
+    queries.create_link_tags_tag_index()
+    # full text index over links, kept current by triggers on links
+    queries.create_links_fts_table()
+    queries.create_links_fts_insert_trigger()
+    queries.create_links_fts_delete_trigger()
+    queries.create_links_fts_update_trigger()
+    # counts every write to links, so a build can tell nothing changed
+    queries.create_links_changes_table()
+    queries.create_links_changes_insert_trigger()
+    queries.create_links_changes_update_trigger()
+    queries.create_links_changes_delete_trigger()
+    # what the Pinboard sync has seen: its last update time and the date of
+    # each bookmark, for finding days whose bookmarks changed
+    queries.create_sync_state_table()
+    queries.create_post_dates_table()
+    queries.create_post_dates_day_index()
+
+    version = queries.schema_version()
+    if version < 1:
+        backfill_link_tags(queries)
+    if version < 2:
+        queries.rebuild_links_fts()
+    if version < 3:
+        queries.init_links_changes()
+    if version < 4:
+        # months are listed from the build's single pass over links now
+        queries.drop_links_year_month_index()
+    if version < SCHEMA_VERSION:
+        queries.engine.execute(f'pragma user_version = {SCHEMA_VERSION}')
+
+def split_tags(tags):
+    """
+    Split a space delimited tags column into its distinct tags, dropping
+    blanks and Pinboard's +/- markers.
+    """
+    if not tags:
+        return []
+    return list(dict.fromkeys(t for t in tags.split(' ') if t and t not in ('+', '-')))
+
+def sync_link_tags(queries, links):
+    """
+    Replace the link_tags rows for links (which must already be stored)
+    with the tags they carry now.
+    """
+    hashes = tuple({link['hash'] for link in links})
+    ids = {row['hash']: row['id'] for row in queries.select_existing_links(hashes=hashes)}
+    queries.delete_link_tags(link_ids=tuple(ids.values()))
+    rows = [{'link_id': ids[link['hash']], 'tag': tag}
+            for link in links for tag in split_tags(link['tags'])]
+    if rows:
+        queries.insert_link_tag(*rows)
+
+def backfill_link_tags(queries):
+    """
+    Rebuild link_tags from the tags column of every stored link.
+    """
+    with queries.transaction():
+        rows = [{'link_id': link['id'], 'tag': tag}
+                for link in queries.select_all_tags() for tag in split_tags(link['tags'])]
+        if rows:
+            queries.insert_link_tag(*rows)
+
+def connect_readonly(url=DB_URL):
+    """
+    Build a pugsql module on a read-only connection to the sqlite file
+    behind url, leaving the schema alone. Used by render workers.
+    """
+    path = make_url(url).database
+    queries = pugsql.module(SQL_PATH)
+    queries.connect(f'sqlite:///file:{path}?mode=ro&uri=true', poolclass=SingletonThreadPool)
     return queries
 
+def module():
+    """
+    Return the process-wide pugsql module, connecting and creating the
+    schema on first use.
+    """
+    global _queries
+    if _queries is None:
+        with _lock:
+            if _queries is None:
+                _queries = connect(DB_URL)
+    return _queries
+
+def close():
+    """
+    Drop the shared module and its connections. The next call to module()
+    reconnects.
+    """
+    global _queries
+    with _lock:
+        if _queries is not None:
+            _queries.engine.dispose()
+            _queries = None
+
+def database_state(queries):
+    """
+    A cheap summary of the links table: its row count, highest id and ts,
+    and the links_changes counter, which every insert, update and delete
+    bumps. Any write to links changes it, and reading it is a few index
+    lookups however big the archive is.
+    """
+    return queries.database_state()
+
+def iter_rows(result):
+    """
+    Yield the rows of a :raw statement's result as dicts as they come off
+    the cursor, rather than fetching them all up front the way :many does.
+    """
+    keys = list(result.keys())
+    for row in result:
+        yield dict(zip(keys, row))
+
 def insert_link(link):
+    return insert_links([link])
+
+def insert_links(links, batch_size=500):
+    """
+    Upsert links in one transaction, leaving unchanged rows untouched.
+    Returns a dict of inserted, updated and unchanged counts.
+    """
     queries = module()
-    return queries.upsert_link(**link)
+    links = iter(links)
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    with queries.transaction():
+        while True:
+            batch = list(itertools.islice(links, batch_size))
+            if not batch:
+                break
+            hashes = tuple({link['hash'] for link in batch})
+            existing = {row['hash']: row for row in queries.select_existing_links(hashes=hashes)}
+            new_links = [link for link in batch if link['hash'] not in existing]
+            known_links = [link for link in batch if link['hash'] in existing]
+
+            if new_links:
+                counts['inserted'] += queries.upsert_link(*new_links)
+            if known_links:
+                updated = queries.update_link(*known_links)
+                counts['updated'] += updated
+                counts['unchanged'] += len(known_links) - updated
+
+            retagged = new_links + [link for link in known_links
+                                    if link['tags'] != existing[link['hash']]['tags']]
+            if retagged:
+                sync_link_tags(queries, retagged)
+    return counts
 
 if __name__ == '__main__':
     print("Hello world")
 #    queries = module()
-#    results = list(queries.select_by_year_month(year_month='2024-03'))
+#    results = list(iter_rows(queries.stream_by_year_month(year_month='2024-03')))
 #    print(results)
@@ -0,0 +1,124 @@
+import hashlib
+import itertools
+import os
+import sqlite3
+from . import manifest
+
+CACHE_PATH = '.cache/fragments.db'
+
+# the link fields fragments are rendered from; prepare_post derives the rest
+LINK_FIELDS = ('ts', 'url', 'description', 'extended', 'via', 'tags', 'hash')
+
+# links are looked up, and new fragments written, in batches of this many
+BATCH_SIZE = 500
+
+class FragmentCache:
+    """
+    Rendered fragments stored in a sqlite database, one row per link and
+    fragment template. A row is only reused if its key, a hash of the
+    link's fields and the template source, still matches; otherwise the
+    fragment is rendered again and replaces it, so the cache never holds
+    more than one fragment per link and template.
+    """
+
+    def __init__(self, env, path=CACHE_PATH):
+        self.env = env
+        self.path = os.path.abspath(path)
+        self.versions = {}
+        self.templates = {}
+        self.loaded = {}
+        self.pending = []
+        # opened on first use, so pool workers forked before this process
+        # renders anything don't inherit a live connection
+        self.conn = None
+
+    def connect(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # pool workers share the file, so wait out each other's flushes
+            self.conn = sqlite3.connect(self.path, timeout=60)
+            self.conn.execute('pragma journal_mode=wal')
+            self.conn.execute(
+                'create table if not exists fragments ('
+                'hash text not null, template text not null, key text not null, fragment text not null, '
+                'primary key (hash, template)) without rowid')
+            self.conn.commit()
+        return self.conn
+
+    def version(self, template):
+        """Hash of template's source, so editing it invalidates its fragments."""
+        if template not in self.versions:
+            source, _, _ = self.env.loader.get_source(self.env, template)
+            digest = hashlib.sha256()
+            digest.update(str(manifest.BUILD_VERSION).encode('utf-8'))
+            digest.update(template.encode('utf-8'))
+            digest.update(source.encode('utf-8'))
+            self.versions[template] = digest.hexdigest()
+        return self.versions[template]
+
+    def key(self, template, link):
+        fields = repr([link[field] for field in LINK_FIELDS])
+        return hashlib.sha256((self.version(template) + fields).encode('utf-8')).hexdigest()
+
+    def preload(self, links):
+        """
+        Pass links through, reading ahead a batch at a time and fetching the
+        batch's cached fragments in one query rather than one per link.
+        """
+        links = iter(links)
+        while True:
+            batch = list(itertools.islice(links, BATCH_SIZE))
+            if not batch:
+                break
+            hashes = [link['hash'] for link in batch]
+            # (hash, None) marks a link as looked up, cached fragments or not
+            self.loaded = {(hash_value, None): None for hash_value in hashes}
+            rows = self.connect().execute(
+                f"select hash, template, key, fragment from fragments where hash in ({','.join('?' * len(hashes))})",
+                hashes)
+            for hash_value, template, key, fragment in rows:
+                self.loaded[(hash_value, template)] = (key, fragment)
+            yield from batch
+        self.loaded = {}
+
+    def lookup(self, template, link):
+        """The cached (key, fragment) for link, or None."""
+        if (link['hash'], None) in self.loaded:
+            return self.loaded.get((link['hash'], template))
+        return self.connect().execute(
+            'select key, fragment from fragments where hash = ? and template = ?',
+            (link['hash'], template)).fetchone()
+
+    def render(self, template, link):
+        """
+        The markup template's render() macro produces for link (a prepared post), from the
+        cache when link and template are unchanged since it was stored.
+        """
+        key = self.key(template, link)
+        row = self.lookup(template, link)
+        if row is not None and row[0] == key:
+            return row[1]
+
+        if template not in self.templates:
+            self.templates[template] = self.env.get_template(template).module.render
+        fragment = self.templates[template](link)
+        self.pending.append((link['hash'], template, key, fragment))
+        if len(self.pending) >= BATCH_SIZE:
+            self.flush()
+        return fragment
+
+    def flush(self):
+        """Store the fragments rendered since the last flush."""
+        if not self.pending:
+            return
+        with self.connect() as conn:
+            conn.executemany(
+                'insert or replace into fragments (hash, template, key, fragment) values (?, ?, ?, ?)',
+                self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
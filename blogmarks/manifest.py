@@ -0,0 +1,156 @@
+from jinja2 import Environment, meta, nodes
+import hashlib
+import json
+import os
+from . import output
+
+MANIFEST_PATH = '_site/.manifest.json'
+STATE_PATH = '_site/.state.json'
+TEMPLATES_PATH = 'templates'
+
+# bump when a change to render.py alters output for the same links and templates
+BUILD_VERSION = 1
+
+def load_manifest(path=MANIFEST_PATH):
+    """
+    Load the manifest from the previous build, or an empty one if there
+    isn't a readable one.
+    """
+    try:
+        with open(path, 'r') as fp:
+            return json.load(fp)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    output.write_file(path, json.dumps(manifest, indent=2, sort_keys=True))
+
+def prune(manifest, produced, root='_site'):
+    """
+    Delete every output in manifest that isn't among the paths produced by
+    this build, such as the pages of a tag no link carries any more or the
+    pages past the last after a --page-size change, and drop them from
+    manifest. Directories left empty under root go too. Returns the paths
+    removed.
+    """
+    removed = sorted(set(manifest) - set(produced))
+    for path in removed:
+        del manifest[path]
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        directory = os.path.dirname(path)
+        while os.path.normpath(directory) != os.path.normpath(root) and os.path.isdir(directory) \
+                and not os.listdir(directory):
+            os.rmdir(directory)
+            directory = os.path.dirname(directory)
+    return removed
+
+def build_state(database_state, options):
+    """
+    Everything a whole build depends on, cheaply: the database's state
+    (see db.database_state), the templates, BUILD_VERSION and the options
+    that change output. If this matches the state saved by the last build,
+    that build's output is still current.
+    """
+    return {
+        'build_version': BUILD_VERSION,
+        'database': database_state,
+        'templates': templates_fingerprint(),
+        'options': options
+    }
+
+def load_state(path=STATE_PATH):
+    try:
+        with open(path, 'r') as fp:
+            return json.load(fp)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def save_state(state, path=STATE_PATH):
+    output.write_file(path, json.dumps(state, indent=2, sort_keys=True))
+
+def templates_fingerprint(path=TEMPLATES_PATH):
+    """
+    Hash the source of every template, so any template edit changes the
+    fingerprint of every output.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(path)):
+        digest.update(name.encode('utf-8'))
+        with open(os.path.join(path, name), 'rb') as fp:
+            digest.update(fp.read())
+    return digest.hexdigest()
+
+def template_dependencies(source):
+    """
+    The templates a template's source pulls in: what it extends, includes
+    and imports, and the fragment templates it renders links with. None
+    stands for a name only known at render time.
+    """
+    ast = Environment().parse(source)
+    names = set(meta.find_referenced_templates(ast))
+    for call in ast.find_all(nodes.Call):
+        if isinstance(call.node, nodes.Name) and call.node.name == 'fragment':
+            argument = call.args[0] if call.args else None
+            names.add(argument.value if isinstance(argument, nodes.Const) else None)
+    return names
+
+def template_fingerprints(path=TEMPLATES_PATH):
+    """
+    Map each template's name to a hash of its source and the sources of
+    every template it depends on, directly or through others, so editing
+    base.html changes the fingerprint of links.html but not of atom.xml.
+    A template with a dependency that can't be worked out before render
+    time depends on them all.
+    """
+    sources = {}
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), 'rb') as fp:
+            sources[name] = fp.read()
+    dependencies = {name: template_dependencies(source.decode('utf-8')) for name, source in sources.items()}
+
+    fingerprints = {}
+    for name in sources:
+        chain = set()
+        pending = [name]
+        while pending:
+            current = pending.pop()
+            if current in chain:
+                continue
+            chain.add(current)
+            if None in dependencies.get(current, ()):
+                chain.update(sources)
+                break
+            pending.extend(dependencies.get(current, ()))
+        digest = hashlib.sha256()
+        for dependency in sorted(chain):
+            digest.update(dependency.encode('utf-8'))
+            digest.update(sources.get(dependency, b''))
+        fingerprints[name] = digest.hexdigest()
+    return fingerprints
+
+# template_fingerprints() for the build in progress, set by render.main()
+# so templates are read once per build rather than once per output
+templates = None
+
+def fingerprint(data, template=None):
+    """
+    Fingerprint everything an output is rendered from: its data (anything
+    json can serialize), BUILD_VERSION and, if it's rendered from a
+    template, that template and everything it depends on.
+    """
+    digest = hashlib.sha256()
+    digest.update(str(BUILD_VERSION).encode('utf-8'))
+    if template is not None:
+        fingerprints = templates if templates is not None else template_fingerprints()
+        digest.update(fingerprints[template].encode('utf-8'))
+    digest.update(json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+def is_current(manifest, path, fp):
+    """
+    True when path exists and was last rendered from fingerprint fp.
+    """
+    return manifest.get(path) == fp and os.path.exists(path)
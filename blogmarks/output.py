@@ -0,0 +1,105 @@
+import collections
+import hashlib
+import os
+import tempfile
+
+# per build counts of files written and skipped, reset by render.main()
+stats = collections.Counter()
+
+# set by render.main() --minify: strip whitespace from pages as they're written
+minify = False
+MINIFY_SUFFIXES = ('.html',)
+
+def file_digest(path):
+    """sha256 of the file at path, or None if there isn't one."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as fp:
+            for block in iter(lambda: fp.read(1 << 16), b''):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+def minify_html(chunks):
+    """
+    Strip the indentation and trailing space from each line of streamed
+    HTML and drop blank lines. Line breaks are kept, so whitespace between
+    inline elements still renders as a space.
+    """
+    pending = ''
+    for chunk in chunks:
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        kept = [line.strip() for line in lines if line.strip()]
+        if kept:
+            yield '\n'.join(kept) + '\n'
+    if pending.strip():
+        yield pending.strip()
+
+def write_file(path, content):
+    """
+    Write content to path unless the file already holds exactly those
+    bytes. content is a str or bytes, or an iterable of them (such as a
+    Jinja template's generate()) which is streamed to disk chunk by chunk
+    without ever being joined in memory.
+
+    The new bytes go to a temp file in the same directory which is then
+    renamed over path, so readers see either the old file or the new one,
+    never a partial write. With minify set, HTML is passed through
+    minify_html on the way. Returns True if the file was written.
+    """
+    if minify and path.endswith(MINIFY_SUFFIXES):
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        if isinstance(content, str):
+            content = ''.join(minify_html([content]))
+        else:
+            content = minify_html(content)
+
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+
+    # whole content in hand: compare before touching the disk at all
+    if isinstance(content, bytes):
+        if file_digest(path) == hashlib.sha256(content).hexdigest():
+            stats['skipped'] += 1
+            return False
+        content = [content]
+
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            for chunk in content:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                digest.update(chunk)
+                fp.write(chunk)
+                size += len(chunk)
+
+            if digest.hexdigest() == file_digest(path):
+                os.unlink(tmp_path)
+                stats['skipped'] += 1
+                return False
+
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    stats['written'] += 1
+    stats['bytes'] += size
+    return True
@@ -1,61 +1,315 @@
 from dotenv import load_dotenv
 import os
-import xmltodict, iso8601, click
-import json, urllib.request, sys
-from typing import Any
+import iso8601, click
+import json, sys
+import argparse
+import calendar
+import codecs
+import collections
+import concurrent.futures
+import itertools
+import re
+import threading
+from typing import Any, Iterator
 from . import db
+from .client import PinboardClient, RateLimiter
 import datetime
 
 load_dotenv()
 
 # make sure you set PINBOARD_API_TOKEN environment variable
 
+# sync_state entry holding posts/update's time as of the last sync
+UPDATE_TIME = 'update_time'
+
+# sync_state entry set once a full posts/all sync has recorded the date of
+# every bookmark; until then reconcile() would refetch every older day
+DATES_COMPLETE = 'dates_complete'
+
+# reconcile() always refetches the newest this many days with bookmarks,
+# since that's when bookmarks mostly get edited
+RECONCILE_DAYS = 7
+
+# bookmark dates are recorded in batches of this many
+BATCH_SIZE = 500
+
+# the rate limiter's last calls, so a new run doesn't call Pinboard sooner
+# than it allows after the last one. Kept out of data.db, which would
+# otherwise change on every run, even one that found nothing new.
+RATE_LIMITS_PATH = '.cache/rate_limits.json'
+
+# bytes of posts/all read at a time while decoding it
+CHUNK_SIZE = 64 * 1024
+
+# the only timestamp format Pinboard sends; anything else goes to iso8601
+PINBOARD_TIME = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)Z')
+
+# what may come between the items of a JSON array
+ARRAY_SEPARATORS = re.compile(r'[\s,\[]*')
+
+# days fetched from posts/get at once; the rate limiter still spaces the
+# calls out, but their downloads overlap
+FETCH_JOBS = 4
+
+# the process's API client, made on first use so it picks up the token
+client = None
+client_lock = threading.Lock()
+
+def api_client():
+	global client
+	with client_lock:
+		if client is None:
+			limiter = RateLimiter(state=load_rate_limits())
+			client = PinboardClient(os.getenv("PINBOARD_API_TOKEN"), limiter=limiter)
+	return client
+
+def load_rate_limits(path=RATE_LIMITS_PATH):
+	try:
+		with open(path) as fp:
+			return json.load(fp)
+	except (OSError, ValueError):
+		return None
+
+def save_rate_limits(path=RATE_LIMITS_PATH):
+	"Record when the API was last called, for the next run's rate limiter"
+	if client is None:
+		return
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+	partial = path + '.partial'
+	with open(partial, 'w') as fp:
+		json.dump(client.limiter.state(), fp)
+	os.replace(partial, path)
+
+def open_api(method, **kwargs):
+	"Call the pinboard API for JSON and return the open response, for decoding as it arrives"
+	return api_client().open(method, format='json', **kwargs)
+
 def pinboard_api(method, **kwargs):
-	"Call the pinboard API and return parsed results from the XML"
-	if 'auth_token' not in kwargs:
-		kwargs['auth_token'] = os.getenv("PINBOARD_API_TOKEN")
-
-	arg_strings = [f'{k}={v}' for k, v in kwargs.items()]
-	args = '?' + '&'.join(arg_strings)
-	url = f'https://api.pinboard.in/v1/{method}{args}'
-	print(url)
-	
-	fp = urllib.request.urlopen(url)
-	dom = xmltodict.parse(fp)
-	return dom
+	"Call the pinboard API and return the decoded JSON"
+	with open_api(method, **kwargs) as fp:
+		return json.load(fp)
 
 def iso_to_unix(ts: str):
+	# Pinboard's own format is read directly, about four times faster than
+	# iso8601, which handles anything else
+	match = PINBOARD_TIME.fullmatch(ts)
+	if match:
+		return calendar.timegm(tuple(map(int, match.groups())))
 	dt = iso8601.parse_date(ts)
 	return int(dt.timestamp())
 
 def newest_time() -> int:
-	dom = pinboard_api('posts/update')
-	return iso_to_unix(dom['update']['@time'])
+	return iso_to_unix(pinboard_api('posts/update')['update_time'])
 
-def fetch_recent(**kwargs) -> list[dict[str, Any]]:
-	"Get the recent.xml from Pinboard"
+def sync_recent(**kwargs):
+	"""
+	The hourly sync. Pinboard's posts/update time moves whenever a
+	bookmark is added, edited or deleted, so when it hasn't moved since the
+	last sync there's nothing to do. When it has, fetch the recent
+	bookmarks; if none of them changed, reconcile. Edits that change no
+	day's count are left for a --all or --reconcile run. Returns
+	insert/update/unchanged counts.
+	"""
+	queries = db.module()
+	update_time = newest_time()
+	last_update = queries.get_sync_state(name=UPDATE_TIME)
+	if last_update is not None and update_time <= int(last_update):
+		print(f'No changes on Pinboard since {unix_to_iso(int(last_update))}')
+		return {'inserted': 0, 'updated': 0, 'unchanged': 0}
 
-	pb_ts = newest_time()
-	db_ts = db.module().latest_ts() or 0
-	if pb_ts <= db_ts:
-		print(f'No new links. Pinboard: {pb_ts}, DB: {db_ts}')
-		return []
-	
+	counts = add_links(fetch_recent(**kwargs))
+	if last_update is not None and not changed(counts):
+		tag = {k: v for k, v in kwargs.items() if k == 'tag'}
+		if not queries.get_sync_state(name=DATES_COMPLETE):
+			print('Bookmark dates not all recorded yet, syncing everything from posts/all')
+			counts = sync_all(**tag)
+		else:
+			counts = reconcile(**tag)
+			if not changed(counts):
+				print('Pinboard changed but no synced bookmark did; run with --all to pick up older edits')
+	queries.set_sync_state(name=UPDATE_TIME, value=str(update_time))
+	return counts
+
+def changed(counts):
+	"Whether a sync's counts show it inserted, updated or forgot anything"
+	return bool(counts['inserted'] or counts['updated'] or counts.get('forgotten'))
+
+def fetch_recent(**kwargs) -> list[dict[str, Any]]:
+	"Get the recent bookmarks from Pinboard"
 	if 'count' not in kwargs:
 		kwargs['count'] = 20
 	
 
-	dom = pinboard_api('posts/recent', **kwargs)
-	links = []
-	for post in dom['posts']['post']:
-		links.append({
-			'ts': iso_to_unix(post['@time']), 'url': post['@href'], 'description': post['@description'], 'extended':
-			post['@extended'], 'tags': post['@tag'], 'hash': post['@hash']
-		})
-	return links
+	return [post_link(post) for post in pinboard_api('posts/recent', **kwargs)['posts']]
+
+def post_link(post):
+	"A link dict from a post in Pinboard's JSON"
+	return {
+		'ts': iso_to_unix(post['time']), 'url': post['href'], 'description': post['description'], 'extended':
+		post.get('extended', ''), 'tags': post.get('tags', ''), 'hash': post['hash']
+	}
+
+def iter_posts(fp) -> Iterator[dict[str, Any]]:
+	"""
+	Yield a link dict for each post in a JSON array of posts, like
+	posts/all's response, as it arrives. Only the post being decoded and
+	the rest of the chunk it's in are held, so memory stays flat however
+	many posts the response holds.
+	"""
+	for post in iter_json_array(fp):
+		yield post_link(post)
+
+def iter_json_array(fp, chunk_size=CHUNK_SIZE):
+	"Yield each item of the JSON array read from the binary file fp, decoding a chunk at a time"
+	decoder = json.JSONDecoder()
+	decode = codecs.getincrementaldecoder('utf-8')().decode
+	buffer = ''
+	while True:
+		chunk = fp.read(chunk_size)
+		buffer += decode(chunk, final=not chunk)
+		position = 0
+		while True:
+			position = ARRAY_SEPARATORS.match(buffer, position).end()
+			if position == len(buffer) or buffer[position] == ']':
+				break
+			try:
+				item, position = decoder.raw_decode(buffer, position)
+			except json.JSONDecodeError:
+				# the item runs on into the next chunk
+				if not chunk:
+					raise
+				break
+			yield item
+		buffer = buffer[position:]
+		if not chunk:
+			return
 
+def fetch_all(fromdt=None, **kwargs) -> Iterator[dict[str, Any]]:
+	"""
+	Stream every bookmark from posts/all, or with fromdt (a unix
+	timestamp) only those created since then, yielding links as they are
+	parsed rather than after the whole response has downloaded.
+	"""
+	if fromdt is not None:
+		kwargs['fromdt'] = unix_to_iso(fromdt)
+
+	with open_api('posts/all', **kwargs) as fp:
+		yield from iter_posts(fp)
+
+def unix_to_iso(ts) -> str:
+	return datetime.datetime.fromtimestamp(int(ts), datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def sync_all(incremental=False, **kwargs):
+	"""
+	Write bookmarks from posts/all straight into the database as they
+	stream in: everything, or when incremental only those created since
+	the newest stored link. A full sync records every bookmark's date, so
+	reconcile() can rely on them from then on. Returns
+	insert/update/unchanged counts.
+	"""
+	queries = db.module()
+	fromdt = queries.latest_ts() if incremental else None
+	counts = add_links(fetch_all(fromdt, **kwargs))
+	if not incremental:
+		queries.set_sync_state(name=DATES_COMPLETE, value='1')
+	return counts
+
+
+def reconcile(days=RECONCILE_DAYS, **kwargs):
+	"""
+	Bring the stored links back in line with Pinboard without downloading
+	everything. posts/dates gives the number of bookmarks Pinboard has on
+	each day; any day where that differs from the dates recorded as links
+	were synced, and the newest days bookmarks were made, are refetched with
+	posts/get and upserted, so only links that changed are written.
+	Bookmarks gone from Pinboard have their dates forgotten and are
+	reported, but their links are left for a person to remove. Until a
+	full sync has recorded every bookmark's date, most days would look
+	changed, so that syncs everything from posts/all instead. Returns
+	insert/update/unchanged/forgotten counts.
+	"""
+	queries = db.module()
+	if not queries.get_sync_state(name=DATES_COMPLETE):
+		print('Bookmark dates not all recorded yet, syncing everything from posts/all')
+		return sync_all(**kwargs)
+
+	local = {row['day']: row['count'] for row in queries.post_date_counts()}
+	remote = fetch_dates(**kwargs)
+	changed = {day for day in remote.keys() | local.keys() if remote.get(day) != local.get(day)}
+	if days:
+		changed.update(sorted(remote)[-days:])
+
+	counts = collections.Counter(inserted=0, updated=0, unchanged=0, forgotten=0)
+	for day, links in fetch_days(sorted(changed), remote, **kwargs):
+		hashes = {link['hash'] for link in links}
+		gone = [row['hash'] for row in queries.select_post_dates(day=day) if row['hash'] not in hashes]
+		if gone:
+			print(f"No longer on Pinboard from {day}: {' '.join(gone)}")
+			queries.delete_post_dates(hashes=tuple(gone))
+			counts['forgotten'] += len(gone)
+		counts.update(add_links(links))
+	print(f'Reconciled {len(changed)} of {len(remote)} days')
+	return dict(counts)
+
+def sync_range(start, end, **kwargs):
+	"""
+	Backfill the days from start to end (YYYY-MM-DD, inclusive) that
+	posts/dates says have bookmarks, fetching them concurrently and
+	upserting each day's links as it arrives. Returns
+	insert/update/unchanged counts.
+	"""
+	remote = fetch_dates(**kwargs)
+	days = sorted(day for day in remote if start <= day <= end)
+	counts = collections.Counter(inserted=0, updated=0, unchanged=0)
+	for day, links in fetch_days(days, remote, **kwargs):
+		counts.update(add_links(links))
+	print(f'Fetched {len(days)} days with bookmarks between {start} and {end}')
+	return dict(counts)
+
+def fetch_days(days, remote, jobs=FETCH_JOBS, **kwargs) -> Iterator[tuple[str, list[dict[str, Any]]]]:
+	"""
+	Yield (day, links) for each of days in order, fetching them from
+	posts/get on jobs threads at once. The threads share the API client's
+	rate limiter, so they never call faster than Pinboard allows, but one
+	day downloads while the next waits its turn. Days missing from remote,
+	posts/dates' counts, have no bookmarks and aren't fetched. Only the
+	caller's thread touches the database.
+	"""
+	def fetch(day):
+		return fetch_day(day, **kwargs) if day in remote else []
+
+	with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+		yield from zip(days, pool.map(fetch, days))
+
+def fetch_dates(**kwargs) -> dict[str, int]:
+	"Pinboard's count of bookmarks per day, from posts/dates"
+	return {day: int(count) for day, count in pinboard_api('posts/dates', **kwargs)['dates'].items()}
+
+def fetch_day(day, **kwargs) -> list[dict[str, Any]]:
+	"Every bookmark Pinboard has on day (YYYY-MM-DD), from posts/get"
+	return [post_link(post) for post in pinboard_api('posts/get', dt=day, **kwargs)['posts']]
 
 def add_links(links):
+	"Munge links and upsert them in one transaction, returning insert/update/unchanged counts"
+	return db.insert_links(publishable_links(record_post_dates(links)))
+
+def record_post_dates(links):
+	"""
+	Pass links straight through, recording the UTC date Pinboard files each
+	under so reconcile() can compare per-day counts with posts/dates. Links
+	skipped as future links are recorded too, since Pinboard counts them.
+	"""
+	queries = db.module()
+	links = iter(links)
+	while True:
+		batch = list(itertools.islice(links, BATCH_SIZE))
+		if not batch:
+			break
+		queries.upsert_post_date(*[{'hash': link['hash'], 'day': unix_to_iso(link['ts'])[:10]} for link in batch])
+		yield from batch
+
+def publishable_links(links):
+	"Munge each link, skipping any dated in the future"
 	now = datetime.datetime.now().timestamp()
 	for link in links:
 		link = munge_link(link)
@@ -64,7 +318,7 @@ def add_links(links):
 			print(f"Skipping future link: {link['url']}")
 			continue
 
-		db.insert_link(link)
+		yield link
 
 def munge_link(link):
 	date_tag = None
@@ -119,16 +373,38 @@ def expand_via_shorthand(via_code):
 	
 	return via_mappings.get(via_code, via_code)
 
-def main():
-	kwargs = {}
-	if os.getenv("PINBOARD_API_COUNT"):
-		kwargs['count'] = os.getenv("PINBOARD_API_COUNT")
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Fetch links from Pinboard into the database.')
+	parser.add_argument('--all', action='store_true',
+		help='sync every bookmark from posts/all instead of just the recent ones')
+	parser.add_argument('--incremental', action='store_true',
+		help='with --all, only bookmarks created since the newest stored link')
+	parser.add_argument('--reconcile', action='store_true',
+		help='refetch just the days whose bookmarks differ from Pinboard, plus the newest few')
+	parser.add_argument('--days', type=int, default=RECONCILE_DAYS,
+		help='with --reconcile, always refetch the newest this many days with bookmarks')
+	parser.add_argument('--range', nargs=2, metavar=('START', 'END'),
+		help='fetch every bookmark made between two dates (YYYY-MM-DD), a day at a time')
+	args = parser.parse_args(argv)
 
+	kwargs = {}
 	if os.getenv("PINBOARD_API_TAG"):
 		kwargs['tag'] = os.getenv("PINBOARD_API_TAG")
 
-	links = fetch_recent(**kwargs)
-	add_links(links)
+	try:
+		if args.all:
+			counts = sync_all(args.incremental, **kwargs)
+		elif args.reconcile:
+			counts = reconcile(args.days, **kwargs)
+		elif args.range:
+			counts = sync_range(*args.range, **kwargs)
+		else:
+			if os.getenv("PINBOARD_API_COUNT"):
+				kwargs['count'] = os.getenv("PINBOARD_API_COUNT")
+			counts = sync_recent(**kwargs)
+	finally:
+		save_rate_limits()
+	print(f"Inserted {counts['inserted']}, updated {counts['updated']}, unchanged {counts['unchanged']}")
 
 if __name__ == '__main__':
 	main()
\ No newline at end of file
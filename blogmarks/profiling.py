@@ -0,0 +1,211 @@
+import cProfile
+import collections
+import contextlib
+import datetime
+import json
+import os
+import pstats
+import time
+from . import output
+
+REPORT_PATH = '.cache/profile.json'
+STATS_PATH = '.cache/profile.prof'
+
+# functions listed from cProfile, hottest cumulative time first
+FUNCTION_COUNT = 25
+
+# the Profile of the running build, None unless profiling; stage() and
+# the render hooks check it, so an ordinary build pays nothing
+current = None
+
+class Profile:
+    """
+    Timings collected over one build. Query time covers executing each
+    statement and, for :raw statements, pulling rows off the cursor.
+    Template time is the time spent producing a template's output, less
+    any query time spent inside it while it pulled links from a cursor.
+    """
+
+    def __init__(self, functions=False):
+        self.started = time.perf_counter()
+        self.stages = []
+        self.queries = collections.defaultdict(collections.Counter)
+        self.templates = collections.defaultdict(collections.Counter)
+        # running total of query seconds, so templates can leave theirs out
+        self.query_seconds = 0.0
+        self.profiler = cProfile.Profile() if functions else None
+
+    def add_query(self, name, seconds, calls=0, rows=0):
+        self.queries[name].update(calls=calls, rows=rows, seconds=seconds)
+        self.query_seconds += seconds
+
+    def time_template(self, name, chunks):
+        """Yield the chunks of a template's output, timing the template."""
+        counts = self.templates[name]
+        counts['renders'] += 1
+        chunks = iter(chunks)
+        while True:
+            queried = self.query_seconds
+            started = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                counts['seconds'] += time.perf_counter() - started - (self.query_seconds - queried)
+            yield chunk
+
+    def take(self):
+        """Hand over the query and template counts so far and start again."""
+        taken = {'queries': dict(self.queries), 'templates': dict(self.templates)}
+        self.queries.clear()
+        self.templates.clear()
+        return taken
+
+    def merge(self, taken):
+        """Add counts handed over by a pool worker's take()."""
+        for name, counts in taken['queries'].items():
+            self.queries[name].update(counts)
+        for name, counts in taken['templates'].items():
+            self.templates[name].update(counts)
+
+    def report(self):
+        report = {
+            'finished': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'seconds': time.perf_counter() - self.started,
+            'stages': self.stages,
+            'queries': sorted(({'statement': name, 'calls': counts['calls'], 'rows': counts['rows'],
+                                'seconds': counts['seconds']} for name, counts in self.queries.items()),
+                              key=lambda q: -q['seconds']),
+            'templates': sorted(({'template': name, 'renders': counts['renders'], 'seconds': counts['seconds']}
+                                 for name, counts in self.templates.items()),
+                                key=lambda t: -t['seconds'])
+        }
+        if self.profiler is not None:
+            report['functions'] = hottest_functions(pstats.Stats(self.profiler))
+        return report
+
+class TimedStatement:
+    """Stands in for a pugsql statement, timing each call."""
+
+    def __init__(self, statement):
+        self.statement = statement
+
+    def __call__(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = self.statement(*args, **kwargs)
+        if current is not None:
+            current.add_query(self.statement.name, time.perf_counter() - started, calls=1)
+            if self.statement.result.display_type == 'raw':
+                return TimedCursor(self.statement.name, result)
+        return result
+
+class TimedCursor:
+    """Wraps a :raw statement's result, timing each row fetched from it."""
+
+    def __init__(self, name, result):
+        self.name = name
+        self.result = result
+
+    def keys(self):
+        return self.result.keys()
+
+    def __iter__(self):
+        rows = iter(self.result)
+        while True:
+            started = time.perf_counter()
+            row = next(rows, None)
+            if current is not None:
+                current.add_query(self.name, time.perf_counter() - started, rows=row is not None)
+            if row is None:
+                return
+            yield row
+
+def instrument(queries):
+    """Time every statement called on a pugsql module."""
+    for statement in queries:
+        setattr(queries, statement.name, TimedStatement(statement))
+
+def uninstrument(queries):
+    for statement in queries:
+        setattr(queries, statement.name, statement)
+
+def start(queries, functions=False):
+    """
+    Start profiling a build that reads from queries. With functions, the
+    build also runs under cProfile.
+    """
+    global current
+    if current is not None and current.profiler is not None:
+        # a pool worker, forked while the parent ran under cProfile
+        current.profiler.disable()
+    current = Profile(functions)
+    instrument(queries)
+    if current.profiler is not None:
+        current.profiler.enable()
+    return current
+
+def stop(queries):
+    """
+    Stop profiling and return the report. cProfile's raw stats, if it
+    ran, are dumped to STATS_PATH for pstats or snakeviz.
+    """
+    global current
+    profile, current = current, None
+    uninstrument(queries)
+    if profile.profiler is not None:
+        profile.profiler.disable()
+        os.makedirs(os.path.dirname(os.path.abspath(STATS_PATH)), exist_ok=True)
+        profile.profiler.dump_stats(STATS_PATH)
+    return profile.report()
+
+def take():
+    """Counts for a pool task to hand back, or None when not profiling."""
+    return current.take() if current is not None else None
+
+@contextlib.contextmanager
+def stage(name):
+    """Record the wall time of a build stage and the files it wrote and skipped."""
+    if current is None:
+        yield
+        return
+    before = collections.Counter(output.stats)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        counts = collections.Counter(output.stats)
+        counts.subtract(before)
+        current.stages.append({'stage': name, 'seconds': seconds, 'written': counts['written'],
+                               'skipped': counts['skipped'], 'bytes': counts['bytes']})
+
+def hottest_functions(stats, count=FUNCTION_COUNT):
+    functions = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:count]
+    return [{'function': pstats.func_std_string(function), 'calls': nc, 'seconds': tt, 'cumulative': ct}
+            for function, (cc, nc, tt, ct, callers) in functions]
+
+def save_report(report, path=REPORT_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as fp:
+        json.dump(report, fp, indent=2)
+
+def format_report(report):
+    lines = [f"{'stage':<24} {'seconds':>9} {'written':>8} {'skipped':>8} {'bytes':>12}"]
+    for s in report['stages']:
+        lines.append(f"{s['stage']:<24} {s['seconds']:9.3f} {s['written']:8} {s['skipped']:8} {s['bytes']:12}")
+    lines.append(f"{'total':<24} {report['seconds']:9.3f}")
+
+    lines += ['', f"{'statement':<24} {'calls':>9} {'rows':>8} {'seconds':>8}"]
+    for q in report['queries']:
+        lines.append(f"{q['statement']:<24} {q['calls']:9} {q['rows']:8} {q['seconds']:8.3f}")
+
+    lines += ['', f"{'template':<24} {'renders':>9} {'seconds':>8}"]
+    for t in report['templates']:
+        lines.append(f"{t['template']:<24} {t['renders']:9} {t['seconds']:8.3f}")
+
+    if 'functions' in report:
+        lines += ['', f"{'cumulative':>10} {'own':>8} {'calls':>9}  function"]
+        for f in report['functions']:
+            lines.append(f"{f['cumulative']:10.3f} {f['seconds']:8.3f} {f['calls']:9}  {f['function']}")
+    return '\n'.join(lines)
@@ -1,20 +1,16 @@
-from jinja2 import Environment, FileSystemLoader
-from . import db
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+from . import db, output, compress, profiling, manifest as build_manifest
+from .fragments import FragmentCache, CACHE_PATH as FRAGMENT_CACHE_PATH
+from .dates import format_ts, format_ts_rfc3339
+from concurrent.futures import ProcessPoolExecutor
+import argparse
 import datetime
+import hashlib
 import json
 import os
 import collections
-
-file_loader = FileSystemLoader('templates')
-env = Environment(loader=file_loader)
-
-def format_ts(ts, format="%Y-%m-%d"):
-    return datetime.datetime.fromtimestamp(ts).strftime(format)
-
-def format_ts_rfc3339(ts):
-    """Format a timestamp as a date suitable for inclusion in Atom feeds."""
-    date = datetime.datetime.fromtimestamp(ts)
-    return date.isoformat() + ("Z" if date.utcoffset() is None else "")
+import itertools
+import urllib.parse
 
 def link_tags(tags, joiner=' '):
     base_url = 'https://pinboard.in/u:kellan/t:'
@@ -35,46 +31,208 @@ def is_url_filter(value):
     
     return value.startswith(('http://', 'https://')) and len(value) > 8
 
-env.filters["format_ts"] = format_ts
-env.filters["link_tags"] = link_tags
-env.filters["format_ts_rfc3339"] = format_ts_rfc3339
-env.filters["is_url"] = is_url_filter
+# compiled templates are cached here between runs; entries are keyed on a
+# checksum of the template source, so an edited template is recompiled
+TEMPLATE_CACHE_PATH = '.cache/templates'
 
-def create_index(count=100, template='links.html'):
-    posts = list(db.module().select_recent(count=count))
-    posts = prepare_posts(posts)
-    data = {
-        'page' : {},
-        'links': posts
+def make_env(cache_path=TEMPLATE_CACHE_PATH):
+    """
+    Build the Jinja environment with the site's filters registered and,
+    unless cache_path is None, a bytecode cache so templates are only
+    parsed and compiled when their source changes.
+    """
+    bytecode_cache = None
+    if cache_path is not None:
+        cache_path = os.path.abspath(cache_path)
+        os.makedirs(cache_path, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(cache_path)
+    env = Environment(loader=FileSystemLoader('templates'), bytecode_cache=bytecode_cache)
+    env.filters["format_ts"] = format_ts
+    env.filters["link_tags"] = link_tags
+    env.filters["format_ts_rfc3339"] = format_ts_rfc3339
+    env.filters["is_url"] = is_url_filter
+    env.globals["fragment"] = render_fragment
+    return env
+
+def render_fragment(template, link):
+    """
+    Jinja global rendering one link's markup with the render() macro in
+    template, reusing the build's fragment cache when there is one.
+    """
+    if fragment_cache is None:
+        return env.get_template(template).module.render(link)
+    return fragment_cache.render(template, link)
+
+# uncached until build_site() or init_worker() sets up the bytecode cache, so
+# importing this module leaves the disk alone
+env = make_env(cache_path=None)
+
+# the build's FragmentCache when run with --fragments, set by main() and
+# in each pool worker by init_worker
+fragment_cache = None
+
+# set in each pool worker by init_worker
+worker_queries = None
+
+# the paths of every output the build in progress produces, current or
+# not, collected by check_manifest() so build_site() can prune the rest
+produced = None
+
+# links on index.html, each page/N.html and each of a tag's pages
+PAGE_SIZE = 100
+
+# links in index.atom and in each tag's feed
+FEED_COUNT = 100
+
+def load_snapshot(count=100, page_size=PAGE_SIZE):
+    """
+    Read every link once: the newest count links, prepared, and a
+    fingerprint of each month, numbered page and tag page.
+    """
+    recent = collections.deque(maxlen=count)
+    months = {}
+    pages = []
+    tags = {}
+    total = 0
+    for position, link in enumerate(db.iter_rows(db.module().stream_links())):
+        encoded = json.dumps(link, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        months.setdefault(ts_year_month(link['ts']), hashlib.sha256()).update(encoded)
+        if position % page_size == 0:
+            pages.append({'count': 0, 'digest': hashlib.sha256()})
+        pages[-1]['digest'].update(encoded)
+        pages[-1]['count'] += 1
+        pages[-1]['newest'] = [link['ts'], link['id']]
+
+        for tag in db.split_tags(link['tags']):
+            tagged = tags.setdefault(tag, {'count': 0, 'pages': []})
+            if tagged['count'] % page_size == 0:
+                tagged['pages'].append(hashlib.sha256())
+            tagged['pages'][-1].update(encoded)
+            tagged['count'] += 1
+
+        recent.append(link)
+        total = position + 1
+
+    for page in pages:
+        page['digest'] = page['digest'].hexdigest()
+    for tagged in tags.values():
+        tagged['pages'] = [digest.hexdigest() for digest in tagged['pages']]
+        # the front page and feed change with the pages their links are on
+        tagged['front'] = newest_pages(tagged['pages'], tagged['count'], page_size, page_size)
+        tagged['feed'] = newest_pages(tagged['pages'], tagged['count'], page_size, FEED_COUNT)
+
+    return {
+        'links': [prepare_post(link) for link in reversed(recent)],
+        'count': total,
+        'front': newest_pages([page['digest'] for page in pages], total, page_size, page_size),
+        'months': {year_month: digest.hexdigest() for year_month, digest in sorted(months.items())},
+        'pages': pages,
+        'tags': dict(sorted(tags.items()))
     }
 
-    os.makedirs('_site', exist_ok=True)
+def newest_pages(digests, count, page_size, newest):
+    """The digests of the pages, oldest first, holding the newest links of count."""
+    return digests[max(0, count - newest) // page_size:]
 
-    with open(f'_site/index.html', 'w') as fp:
-        fp.write(render(template, data)) 
-    
+def page_count(count, page_size):
+    """
+    How many numbered pages count links make. There are none while the
+    front page holds every link; after that page 1 holds the oldest
+    page_size links, page 2 the next, and the last page the newest few.
+    """
+    return 0 if count <= page_size else (count - 1) // page_size + 1
+
+def front_older(count, page_size):
+    """The numbered page the front page's older link goes to, the one holding the next link back."""
+    return (count - page_size - 1) // page_size + 1 if count > page_size else None
 
-def create_archives():
-    # fetch all year-month combinations from links
-    year_months = db.module().distinct_year_months()
+def ts_year_month(ts):
+    """The UTC YYYY-MM a timestamp falls in, matching the archive queries."""
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime('%Y-%m')
+
+def create_index(page_size=PAGE_SIZE, template='links.html', snapshot=None, manifest=None, pool=None):
+    """
+    Render index.html and each page/N.html whose links changed, numbering
+    pages from the oldest link.
+    """
+    if snapshot is None:
+        snapshot = load_snapshot(page_size, page_size)
+    queries = db.module()
+    count = page_count(snapshot['count'], page_size)
+    pending = []
+
+    page = page_nav(None, count, older=front_older(snapshot['count'], page_size))
+    data = {
+        'page' : page,
+        'links': snapshot['links'][:page_size]
+    }
+    write_output('_site/index.html', template, [page, snapshot['front']],
+                 lambda: render_stream(template, data), manifest)
+
+    for number, snapshot_page in enumerate(snapshot['pages'][:count], start=1):
+        path = '_site/' + page_path(number)
+        page = page_nav(number, count)
+        inputs = [page, snapshot_page['digest']]
+        args = (snapshot_page['newest'], snapshot_page['count'], page)
+        if pool is None:
+            write_output(path, template, inputs, lambda: render_page(queries, *args), manifest)
+        else:
+            pending.append(submit_output(pool, path, template, inputs, write_page, args, manifest))
+
+    return [p for p in pending if p is not None]
+
+def page_path(number=None):
+    """Where a numbered page of the index lives, or the front page with None, relative to _site."""
+    return 'index.html' if number is None else f'page/{number}.html'
+
+def page_nav(number, page_count, path=page_path, title=None, older=None):
+    """
+    The page variables for numbered page number of page_count, or the
+    front page when number is None, where path(number) gives each page's
+    location: a title, the path back to the site root for links from
+    base.html, and the newer and older pages if there are any. Newer from
+    the last numbered page is the front page; older from the front page is
+    the numbered page given.
+    """
+    page = {}
+    root = '../' * path(number).count('/')
+    if root:
+        page['root'] = root
+    if title:
+        page['title'] = title if number is None else f'{title}, page {number}'
+    elif number is not None:
+        page['title'] = f'Page {number}'
+    if number is not None:
+        page['newer'] = urllib.parse.quote(root + path(number + 1 if number < page_count else None))
+        older = number - 1 if number > 1 else None
+    if older is not None:
+        page['older'] = urllib.parse.quote(root + path(older))
+    return page
+
+def create_archives(snapshot=None, manifest=None, pool=None):
+    """
+    Render a page per month plus archive.html. Given a pool (see
+    make_pool), months are rendered by its workers instead, and the
+    pending results are returned for finish_outputs().
+    """
+    if snapshot is None:
+        snapshot = load_snapshot()
+    queries = db.module()
 
     archives = collections.defaultdict(list)
+    pending = []
 
-    for year_month in year_months:
-        (year, month) = year_month["year_month"].split('-')
+    for year_month, digest in snapshot['months'].items():
+        (year, month) = year_month.split('-')
         archives[year].append(month)
 
-        posts = list(db.module().select_by_year_month(**year_month))
-        posts = prepare_posts(posts)
-        
-        data = {
-            'page': {'title': f'Archive: {year_month["year_month"]}'},
-            'links': posts
-        }
-
-        os.makedirs('_site', exist_ok=True)
-        with open(f'_site/{year_month["year_month"]}.html', 'w') as fp:
-            fp.write(render('links.html', data)) 
+        # only months whose links changed since the last build are rendered
+        path = f'_site/{year_month}.html'
+        inputs = [year_month, digest]
+        if pool is None:
+            write_output(path, 'links.html', inputs, lambda: render_month(queries, year_month), manifest)
+        else:
+            pending.append(submit_output(pool, path, 'links.html', inputs, write_month, year_month, manifest))
 
 
     data = {
@@ -82,12 +240,123 @@ def create_archives():
         'year_months' : archives
     }
 
-    with open(f"_site/archive.html", 'w') as fp:
-        fp.write(render('archive.html', data))
+    write_output('_site/archive.html', 'archive.html', data, lambda: render('archive.html', data), manifest)
+    return [p for p in pending if p is not None]
+
+def create_tags(page_size=PAGE_SIZE, snapshot=None, manifest=None, pool=None):
+    """Render the stale pages and feed of every tag, plus tags.html."""
+    if snapshot is None:
+        snapshot = load_snapshot(page_size=page_size)
+    queries = db.module()
+    pending = []
+
+    for tag, tagged in snapshot['tags'].items():
+        stale = {}
+        fingerprints = {}
+        count = page_count(tagged['count'], page_size)
+        title = f'Tagged {tag}'
+        path_of = lambda number=None, tag=tag: tag_page_path(tag, number)
+        pages = {'front': (path_of(), page_nav(None, count, path_of, title, front_older(tagged['count'], page_size)),
+                           tagged['front'])}
+        for number, digest in enumerate(tagged['pages'][:count], start=1):
+            pages[number] = (path_of(number), page_nav(number, count, path_of, title), digest)
+        for key, (path, page, digest) in pages.items():
+            path = '_site/' + path
+            current, fingerprints[path] = check_manifest(manifest, path, 'links.html', [page, digest])
+            if current:
+                output.stats['skipped'] += 1
+            else:
+                stale[key] = (path, page)
+
+        path = '_site/' + tag_feed_path(tag)
+        feed = {'path': urllib.parse.quote(tag_page_path(tag)), 'tag': tag}
+        current, fingerprints[path] = check_manifest(manifest, path, 'atom.xml', [feed, tagged['feed']])
+        if current:
+            output.stats['skipped'] += 1
+        else:
+            stale['feed'] = (path, feed)
+
+        if not stale:
+            continue
+        fingerprints = {path: fingerprints[path] for path, _ in stale.values()}
+        args = (stale, page_size, tagged['count'])
+        if pool is None:
+            render_tag(queries, tag, *args)
+            if manifest is not None:
+                manifest.update(fingerprints)
+        else:
+            pending.append((fingerprints, pool.submit(write_tag, tag, args)))
+
+    tag_counts = [(tag, tagged['count'], urllib.parse.quote(tag_page_path(tag)))
+                  for tag, tagged in snapshot['tags'].items()]
+    tag_counts.sort(key=lambda t: (-t[1], t[0]))
+    data = {
+        'page': {'title': 'Tags'},
+        'tags': tag_counts
+    }
+    write_output('_site/tags.html', 'tags.html', data, lambda: render('tags.html', data), manifest)
+    return pending
+
+def tag_filename(tag):
+    """
+    A tag as a file name: the tag itself, with % and / escaped and a
+    leading dot escaped so it can't name a hidden or parent directory.
+    """
+    name = tag.replace('%', '%25').replace('/', '%2F')
+    if name.startswith('.'):
+        name = '%2E' + name[1:]
+    return name
+
+def tag_page_path(tag, number=None):
+    """Where a numbered page of a tag lives, or its front page with None, relative to _site."""
+    name = tag_filename(tag)
+    return f'tag/{name}.html' if number is None else f'tag/{name}/{number}.html'
 
-def create_recent_json(count=15):
-    posts = list(db.module().select_recent(count=count))
-    posts = prepare_posts(posts)
+def tag_feed_path(tag):
+    return f'tag/{tag_filename(tag)}.atom'
+
+def render_tag(queries, tag, stale, page_size, count):
+    """
+    Write a tag's stale outputs from one pass over its links, newest first.
+    """
+    posts = map(prepare_post, db.iter_rows(queries.stream_by_tag(tag=tag)))
+    if fragment_cache is not None:
+        posts = fragment_cache.preload(posts)
+
+    head = list(itertools.islice(posts, max(page_size if 'front' in stale else 0,
+                                            FEED_COUNT if 'feed' in stale else 0)))
+    if 'front' in stale:
+        path, page = stale['front']
+        output.write_file(path, render_stream('links.html', {'page': page, 'links': head[:page_size]}))
+    if 'feed' in stale:
+        path, feed = stale['feed']
+        output.write_file(path, render_stream('atom.xml', {'feed': feed, 'links': head[:FEED_COUNT]}))
+
+    numbers = [key for key in stale if isinstance(key, int)]
+    if not numbers:
+        return
+    posts = itertools.chain(head, posts)
+    last = page_count(count, page_size)
+    for number in range(last, min(numbers) - 1, -1):
+        # the newest page holds what's left over from the full pages below it
+        size = count - (last - 1) * page_size if number == last else page_size
+        chunk = list(itertools.islice(posts, size))
+        if number in stale:
+            path, page = stale[number]
+            output.write_file(path, render_stream('links.html', {'page': page, 'links': chunk}))
+
+def write_tag(tag, args):
+    """Pool task: like write_month, for all of a tag's stale outputs."""
+    output.stats.clear()
+    render_tag(worker_queries, tag, *args)
+    if fragment_cache is not None:
+        fragment_cache.flush()
+    return task_result()
+
+def create_recent_json(count=15, snapshot=None, manifest=None):
+    if snapshot is None:
+        snapshot = load_snapshot(count)
+    posts = snapshot['links'][:count]
     recent = []
     for post in posts:
         recent.append({
@@ -98,48 +367,187 @@ def create_recent_json(count=15):
             'quotable': post.get('quotable', False),
         })
 
-    os.makedirs('_site', exist_ok=True)
+    write_output('_site/recent_links.json', None, recent,
+                 lambda: json.dumps(recent, indent=2, ensure_ascii=False), manifest)
 
-    with open('_site/recent_links.json', 'w') as fp:
-        json.dump(recent, fp, indent=2, ensure_ascii=False)
 
-
-def create_feed(count=100):
-    posts = list(db.module().select_recent(count=count))
-    posts = prepare_posts(posts)
+def create_feed(count=100, snapshot=None, manifest=None):
+    if snapshot is None:
+        snapshot = load_snapshot(count)
+    posts = snapshot['links'][:count]
     data = {
         'links': posts
     }
 
-    os.makedirs('_site', exist_ok=True)
-
     template = 'atom.xml'
 
-    with open(f'_site/index.atom', 'w') as fp:
-        fp.write(render(template, data)) 
+    write_output('_site/index.atom', template, data, lambda: render_stream(template, data), manifest)
     
 
+def check_manifest(manifest, path, template, inputs):
+    """
+    Fingerprint the output at path from template (None for outputs that
+    don't use one), the templates it depends on, and inputs (the data it's
+    rendered from), and report whether the manifest says path is already
+    current. Without a manifest nothing is current.
+    """
+    if produced is not None:
+        produced.add(path)
+    if manifest is None:
+        return False, None
+    if output.minify:
+        inputs = [inputs, 'minified']
+    fingerprint = build_manifest.fingerprint(inputs, template)
+    return build_manifest.is_current(manifest, path, fingerprint), fingerprint
+
+def write_output(path, template, inputs, produce, manifest=None):
+    """
+    Write the text returned by produce() to path through output.write_file,
+    which leaves the file alone if the bytes are the same. Given a manifest,
+    skip the render entirely if path was last built from the same inputs
+    and template chain. Returns True if the file was written.
+    """
+    current, fingerprint = check_manifest(manifest, path, template, inputs)
+    if current:
+        output.stats['skipped'] += 1
+        return False
+
+    written = output.write_file(path, produce())
+
+    if manifest is not None:
+        manifest[path] = fingerprint
+    return written
+
+def submit_output(pool, path, template, inputs, task, arg, manifest=None):
+    """
+    Like write_output, but task(path, arg) renders and writes the file in a
+    pool worker. Returns a pending result for finish_outputs(), or None if
+    the manifest says path is current.
+    """
+    current, fingerprint = check_manifest(manifest, path, template, inputs)
+    if current:
+        output.stats['skipped'] += 1
+        return None
+    return ({path: fingerprint}, pool.submit(task, path, arg))
+
+def finish_outputs(pending, manifest=None):
+    """
+    Wait for pool renders, folding their counts, timings and the
+    fingerprints of the files they wrote in.
+    """
+    for fingerprints, future in pending:
+        stats, profiled = future.result()
+        output.stats.update(stats)
+        if profiled is not None and profiling.current is not None:
+            profiling.current.merge(profiled)
+        if manifest is not None:
+            manifest.update(fingerprints)
+
+def make_pool(jobs, fragments=False):
+    """
+    A process pool of jobs workers, each with its own read-only connection
+    to the current database and its own Jinja environment, and with
+    fragments its own handle on the fragment cache. Workers minify, and
+    profile their queries and templates, if this process does.
+    """
+    return ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                               initargs=(str(db.module().engine.url), fragments, output.minify,
+                                         profiling.current is not None))
+
+def init_worker(db_url, fragments=False, minify=False, profile=False):
+    global env, worker_queries, fragment_cache
+    output.minify = minify
+    env = make_env()
+    worker_queries = db.connect_readonly(db_url)
+    fragment_cache = FragmentCache(env) if fragments else None
+    if profile:
+        profiling.start(worker_queries)
+
+def render_month(queries, year_month):
+    """
+    Stream the archive page for a month: rows flow from the cursor through
+    prepare_post into the template, and the page comes out in chunks.
+    """
+    posts = map(prepare_post, db.iter_rows(queries.stream_by_year_month(year_month=year_month)))
+    if fragment_cache is not None:
+        posts = fragment_cache.preload(posts)
+    data = {
+        'page': {'title': f'Archive: {year_month}'},
+        'links': posts
+    }
+    return render_stream('links.html', data)
+
+def render_page(queries, newest, count, page):
+    """
+    Stream a numbered page of the index: the count links from the (ts, id)
+    keyset newest back, newest first.
+    """
+    ts, link_id = newest
+    posts = map(prepare_post, db.iter_rows(queries.stream_page(ts=ts, id=link_id, count=count)))
+    if fragment_cache is not None:
+        posts = fragment_cache.preload(posts)
+    data = {
+        'page': page,
+        'links': posts
+    }
+    return render_stream('links.html', data)
+
+def write_page(path, args):
+    """Pool task: like write_month, for a page of the index."""
+    output.stats.clear()
+    output.write_file(path, render_page(worker_queries, *args))
+    if fragment_cache is not None:
+        fragment_cache.flush()
+    return task_result()
+
+def write_month(path, year_month):
+    """
+    Pool task: render a month on the worker's connection and write it to
+    path. Returns the worker's output counts for the task.
+    """
+    output.stats.clear()
+    output.write_file(path, render_month(worker_queries, year_month))
+    if fragment_cache is not None:
+        fragment_cache.flush()
+    return task_result()
+
+def task_result():
+    """
+    What a pool task hands back: the worker's output counts for the task
+    and, when the build is profiled, its query and template timings.
+    """
+    return dict(output.stats), profiling.take()
+
+
 def prepare_posts(links):
-    munged_links = []
-    for link in links:
-        clean_tags = link['tags'].split(' ')
-        clean_tags = list(filter(lambda t: t not in ('+', '-'), clean_tags))
-        link['clean_tags'] = sorted(clean_tags)
-        if 'quotable' in clean_tags:
-            link['quotable'] = True
-
-        #markdown = mistune.create_markdown()
-        #link['extended'] = markdown(link['extended'])
-
-        munged_links.append(link)
-    
-    return munged_links
+    return [prepare_post(link) for link in links]
+
+def prepare_post(link):
+    clean_tags = link['tags'].split(' ')
+    clean_tags = list(filter(lambda t: t not in ('+', '-'), clean_tags))
+    link['clean_tags'] = sorted(clean_tags)
+    if 'quotable' in clean_tags:
+        link['quotable'] = True
+
+    #markdown = mistune.create_markdown()
+    #link['extended'] = markdown(link['extended'])
+
+    return link
 
 
 def render(template, data):
     template = env.get_template(template)
+    if profiling.current is not None:
+        return ''.join(profiling.current.time_template(template.name, template.generate(data)))
     return template.render(data)
 
+def render_stream(template, data):
+    """Like render, but yield the output in chunks as the template runs."""
+    template = env.get_template(template)
+    if profiling.current is not None:
+        return profiling.current.time_template(template.name, template.generate(data))
+    return template.generate(data)
+
 def test():
     template = env.get_template('page.html')
     # Define the data to pass to the template
@@ -154,11 +562,118 @@ def test():
     output = template.render(data)
     print(output)
 
-def main():
-    create_index()
-    create_archives()
-    create_feed()
-    create_recent_json()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render the link blog into _site.')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='render archive months across this many worker processes')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE,
+                        help='links on index.html and each page/N.html and tag page')
+    parser.add_argument('--minify', action='store_true',
+                        help='strip indentation and blank lines from HTML pages')
+    parser.add_argument('--compress', action='append', choices=sorted(compress.CODECS), default=[],
+                        help='also write precompressed copies with this extension, e.g. index.html.gz')
+    parser.add_argument('--fragments', action='store_true',
+                        help="reuse each link's rendered markup from " + FRAGMENT_CACHE_PATH)
+    parser.add_argument('--profile', action='store_true',
+                        help='report time per stage, pugsql statement and template, saved to '
+                             + profiling.REPORT_PATH)
+    parser.add_argument('--cprofile', action='store_true',
+                        help='--profile, and run under cProfile, listing the hottest functions '
+                             'and dumping its stats to ' + profiling.STATS_PATH)
+    parser.add_argument('--force', action='store_true',
+                        help='render even if the links, templates and options are as they were '
+                             'at the last build')
+    args = parser.parse_args(argv)
+
+    output.stats.clear()
+    output.minify = args.minify
+    if args.profile or args.cprofile:
+        profiling.start(db.module(), functions=args.cprofile)
+
+    try:
+        with profiling.stage('state'):
+            options = {'page_size': args.page_size, 'minify': args.minify, 'compress': sorted(set(args.compress))}
+            state = build_manifest.build_state(db.database_state(db.module()), options)
+            manifest = build_manifest.load_manifest()
+            # a deleted output is rebuilt even when nothing else changed
+            unchanged = (not args.force and build_manifest.load_state() == state
+                         and all(os.path.exists(path) for path in manifest))
+        if not unchanged:
+            build_site(args, manifest, state)
+    finally:
+        report = profiling.stop(db.module()) if profiling.current is not None else None
+
+    if unchanged:
+        print('Nothing changed since the last build (--force to render anyway)')
+    else:
+        print(f"Wrote {output.stats['written']} files ({output.stats['bytes']} bytes), "
+              f"skipped {output.stats['skipped']} unchanged"
+              + (f", removed {output.stats['removed']} no longer built" if output.stats['removed'] else ''))
+    if report is not None:
+        profiling.save_report(report)
+        print()
+        print(profiling.format_report(report))
+        print(f'Profile saved to {profiling.REPORT_PATH}')
+
+def build_site(args, manifest, state):
+    """
+    Render everything that changed since manifest's build into _site, for
+    main(), delete what the last build made and this one didn't, and save
+    the new manifest and build state.
+    """
+    global env, fragment_cache, produced
+    env = make_env()
+    with profiling.stage('snapshot'):
+        snapshot = load_snapshot(count=max(100, args.page_size), page_size=args.page_size)
+    if args.fragments:
+        fragment_cache = FragmentCache(env)
+    build_manifest.templates = build_manifest.template_fingerprints()
+    produced = set()
+
+    try:
+        if args.jobs > 1:
+            with make_pool(args.jobs, args.fragments) as pool:
+                # months render in the workers while this process does the rest
+                with profiling.stage('archives'):
+                    pending = create_archives(snapshot=snapshot, manifest=manifest, pool=pool)
+                with profiling.stage('index'):
+                    pending += create_index(args.page_size, snapshot=snapshot, manifest=manifest, pool=pool)
+                with profiling.stage('tags'):
+                    pending += create_tags(args.page_size, snapshot=snapshot, manifest=manifest, pool=pool)
+                with profiling.stage('feed'):
+                    create_feed(snapshot=snapshot, manifest=manifest)
+                with profiling.stage('recent json'):
+                    create_recent_json(snapshot=snapshot, manifest=manifest)
+                # workers' files are counted here, as their results come in
+                with profiling.stage('pool'):
+                    finish_outputs(pending, manifest)
+        else:
+            with profiling.stage('index'):
+                create_index(args.page_size, snapshot=snapshot, manifest=manifest)
+            with profiling.stage('archives'):
+                create_archives(snapshot=snapshot, manifest=manifest)
+            with profiling.stage('tags'):
+                create_tags(args.page_size, snapshot=snapshot, manifest=manifest)
+            with profiling.stage('feed'):
+                create_feed(snapshot=snapshot, manifest=manifest)
+            with profiling.stage('recent json'):
+                create_recent_json(snapshot=snapshot, manifest=manifest)
+        built = produced
+    finally:
+        build_manifest.templates = None
+        produced = None
+        if fragment_cache is not None:
+            fragment_cache.close()
+            fragment_cache = None
+
+    with profiling.stage('manifest'):
+        # outputs the last build made and this one didn't are stale
+        output.stats['removed'] += len(build_manifest.prune(manifest, built))
+        build_manifest.save_manifest(manifest)
+        build_manifest.save_state(state)
+    with profiling.stage('compress'):
+        # without --compress this only removes siblings earlier builds left
+        compress.compress_site('_site', args.compress)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
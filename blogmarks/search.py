@@ -0,0 +1,44 @@
+import argparse
+from . import db
+from .dates import format_ts
+
+def fts_query(text):
+    """
+    Turn free text into an FTS5 query: every word must match, punctuation
+    is taken literally, and a trailing * keeps its prefix-match meaning.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*') and len(word) > 1
+        if prefix:
+            word = word[:-1]
+        term = '"' + word.replace('"', '""') + '"'
+        terms.append(term + '*' if prefix else term)
+    return ' '.join(terms)
+
+def search(text, count=20, start='<b>', end='</b>'):
+    """
+    Search links by description, extended, tags and via, best match first.
+    Each result carries a snippet with matches wrapped in start/end.
+    """
+    query = fts_query(text)
+    if not query:
+        return []
+    return list(db.module().search_links(query=query, count=count, start=start, end=end))
+
+def main():
+    parser = argparse.ArgumentParser(description='Search the link archive.')
+    parser.add_argument('terms', nargs='+', help='words to search for, word* for a prefix')
+    parser.add_argument('-n', '--count', type=int, default=20, help='maximum results to show')
+    args = parser.parse_args()
+
+    results = search(' '.join(args.terms), count=args.count, start='[', end=']')
+    for link in results:
+        print(f"{format_ts(link['ts'])}  {link['description']}")
+        print(f"    {link['url']}")
+        print(f"    {link['snippet']}")
+        print()
+    print(f"{len(results)} results")
+
+if __name__ == '__main__':
+    main()
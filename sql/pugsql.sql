@@ -5,6 +5,28 @@ from links
 order by ts desc
 limit :count;
 
+-- :name stream_links :raw
+select
+        id, ts, url, description, extended, via, tags, hash
+from links
+order by ts, id;
+
+-- :name stream_by_year_month :raw
+select
+        id, ts, url, description, extended, via, tags, hash
+from links
+where ts >= cast(strftime('%s', :year_month || '-01') as integer)
+    and ts < cast(strftime('%s', :year_month || '-01', '+1 month') as integer)
+order by ts desc, id desc;
+
+-- :name stream_page :raw
+select
+        id, ts, url, description, extended, via, tags, hash
+from links
+where (ts, id) <= (:ts, :id)
+order by ts desc, id desc
+limit :count;
+
 -- :name create_links_tables 
 create table if not exists links (
     id integer primary key autoincrement,
@@ -16,18 +38,190 @@ create table if not exists links (
     tags text,  -- space delimited
     hash text unique)
 
--- :name upsert_link :insert
-insert or replace into links
+-- :name create_link_tags_table
+create table if not exists link_tags (
+    link_id integer not null references links (id),
+    tag text not null,
+    primary key (link_id, tag)) without rowid
+
+-- :name create_link_tags_tag_index
+create index if not exists link_tags_tag on link_tags (tag, link_id)
+
+-- :name create_links_fts_table
+create virtual table if not exists links_fts using fts5 (
+    description, extended, tags, via,
+    content='links', content_rowid='id')
+
+-- :name create_links_fts_insert_trigger
+create trigger if not exists links_fts_insert after insert on links begin
+    insert into links_fts (rowid, description, extended, tags, via)
+    values (new.id, new.description, new.extended, new.tags, new.via);
+end
+
+-- :name create_links_fts_delete_trigger
+create trigger if not exists links_fts_delete after delete on links begin
+    insert into links_fts (links_fts, rowid, description, extended, tags, via)
+    values ('delete', old.id, old.description, old.extended, old.tags, old.via);
+end
+
+-- :name create_links_fts_update_trigger
+create trigger if not exists links_fts_update after update of description, extended, tags, via on links begin
+    insert into links_fts (links_fts, rowid, description, extended, tags, via)
+    values ('delete', old.id, old.description, old.extended, old.tags, old.via);
+    insert into links_fts (rowid, description, extended, tags, via)
+    values (new.id, new.description, new.extended, new.tags, new.via);
+end
+
+-- :name rebuild_links_fts
+insert into links_fts (links_fts) values ('rebuild')
+
+-- :name create_links_changes_table
+create table if not exists links_changes (
+    id integer primary key check (id = 1),
+    counter integer not null)
+
+-- :name init_links_changes
+insert or ignore into links_changes (id, counter) values (1, 0)
+
+-- :name create_links_changes_insert_trigger
+create trigger if not exists links_changes_insert after insert on links begin
+    update links_changes set counter = counter + 1 where id = 1;
+end
+
+-- :name create_links_changes_update_trigger
+create trigger if not exists links_changes_update after update on links begin
+    update links_changes set counter = counter + 1 where id = 1;
+end
+
+-- :name create_links_changes_delete_trigger
+create trigger if not exists links_changes_delete after delete on links begin
+    update links_changes set counter = counter + 1 where id = 1;
+end
+
+-- :name create_sync_state_table
+create table if not exists sync_state (
+    name text primary key,
+    value text) without rowid
+
+-- :name get_sync_state :scalar
+select value from sync_state where name = :name
+
+-- :name set_sync_state
+insert into sync_state (name, value) values (:name, :value)
+on conflict (name) do update set value = excluded.value
+
+-- :name create_post_dates_table
+create table if not exists post_dates (
+    hash text primary key,
+    day text not null) without rowid  -- the UTC date Pinboard files the bookmark under
+
+-- :name create_post_dates_day_index
+create index if not exists post_dates_day on post_dates (day)
+
+-- :name upsert_post_date
+insert into post_dates (hash, day) values (:hash, :day)
+on conflict (hash) do update set day = excluded.day
+where post_dates.day is not excluded.day
+
+-- :name post_date_counts :many
+select day, count(*) as count
+from post_dates
+group by day
+order by day
+
+-- :name select_post_dates :many
+select hash from post_dates where day = :day
+
+-- :name delete_post_dates
+delete from post_dates where hash in :hashes
+
+-- :name database_state :one
+select
+        (select count(*) from links) as count,
+        (select max(id) from links) as max_id,
+        (select max(ts) from links) as max_ts,
+        (select counter from links_changes where id = 1) as changes
+
+-- :name schema_version :scalar
+pragma user_version
+
+-- :name create_links_ts_index
+create index if not exists links_ts on links (ts)
+
+-- :name drop_links_year_month_index
+drop index if exists links_year_month
+
+-- :name upsert_link :affected
+insert into links
     (ts, url, description, extended, via, tags, hash)
 values
     (:ts, :url, :description, :extended, :via, :tags, :hash)
+on conflict (hash) do update set
+    ts = excluded.ts,
+    url = excluded.url,
+    description = excluded.description,
+    extended = excluded.extended,
+    via = excluded.via,
+    tags = excluded.tags
+where links.ts is not excluded.ts
+    or links.url is not excluded.url
+    or links.description is not excluded.description
+    or links.extended is not excluded.extended
+    or links.via is not excluded.via
+    or links.tags is not excluded.tags
 
+-- :name update_link :affected
+update links set
+    ts = :ts,
+    url = :url,
+    description = :description,
+    extended = :extended,
+    via = :via,
+    tags = :tags
+where hash = :hash
+    and (ts is not :ts
+        or url is not :url
+        or description is not :description
+        or extended is not :extended
+        or via is not :via
+        or tags is not :tags)
 
--- :name distinct_year_months :many
-select distinct strftime('%Y-%m', ts, 'unixepoch') as year_month from links;
+-- :name select_existing_links :many
+select id, hash, tags from links where hash in :hashes;
 
--- :name select_by_year_month :many
-select * from links where strftime('%Y-%m', ts, 'unixepoch') = :year_month;
+-- :name select_all_tags :many
+select id, tags from links;
+
+-- :name delete_link_tags
+delete from link_tags where link_id in :link_ids
+
+-- :name insert_link_tag
+insert or ignore into link_tags (link_id, tag) values (:link_id, :tag)
+
+-- :name stream_by_tag :raw
+select
+        l.id, l.ts, l.url, l.description, l.extended, l.via, l.tags, l.hash
+from link_tags t
+join links l on l.id = t.link_id
+where t.tag = :tag
+order by l.ts desc, l.id desc;
+
+-- :name tag_counts :many
+select tag, count(*) as count
+from link_tags
+group by tag
+order by count desc, tag;
 
 -- :name latest_ts :scalar
-select max(ts) from links;
\ No newline at end of file
+select max(ts) from links;
+
+-- :name search_links :many
+select
+        l.id, l.ts, l.url, l.description, l.extended, l.via, l.tags, l.hash,
+        snippet(links_fts, -1, :start, :end, '…', 12) as snippet
+from links_fts
+join links l on l.id = links_fts.rowid
+where links_fts match :query
+-- weights follow the column order: description, extended, tags, via
+order by bm25(links_fts, 10.0, 1.0, 5.0, 2.0)
+limit :count;
\ No newline at end of file
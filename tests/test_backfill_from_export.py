@@ -15,13 +15,8 @@ def temp_db_with_existing_links():
     
     # Override the db module to use temp database
     original_module_func = db.module
-    def temp_module():
-        queries = original_module_func()
-        queries.connect(f'sqlite:///{temp_path}')
-        queries.create_links_tables()
-        return queries
-    
-    db.module = temp_module
+    queries = db.connect(f'sqlite:///{temp_path}')
+    db.module = lambda: queries
     db.module()  # Initialize tables
     
     # Insert test links that exist in database but have NULL via field
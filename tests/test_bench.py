@@ -0,0 +1,89 @@
+# ABOUTME: Test suite for the render benchmark and its synthetic data generator
+# ABOUTME: Tests generated link shapes, database reuse, stage timings and the results file
+import pytest
+import json
+import os
+from blogmarks import bench, db, pinboard
+
+class TestGenerateLinks:
+    """Test bench.generate_links"""
+
+    def test_deterministic(self):
+        assert list(bench.generate_links(50, seed=1)) == list(bench.generate_links(50, seed=1))
+        assert list(bench.generate_links(50, seed=1)) != list(bench.generate_links(50, seed=2))
+
+    def test_link_shape(self):
+        links = list(bench.generate_links(2000))
+
+        assert len({link['hash'] for link in links}) == 2000
+        assert all(link['tags'].split()[0] == 'mlp' for link in links)
+        quotable = sum('quotable' in link['tags'].split() for link in links) / len(links)
+        via = sum(link['via'] is not None for link in links) / len(links)
+        assert 0.02 < quotable < 0.07
+        assert 0.12 < via < 0.22
+        assert all(bench.END_TS - bench.SPAN_YEARS * 366 * 86400 < link['ts'] < bench.END_TS
+                   for link in links)
+
+    def test_tags_are_skewed(self):
+        """Test a few tags are common and most are rare, like a real archive"""
+        counts = {}
+        for link in bench.generate_links(2000):
+            for tag in link['tags'].split()[1:]:
+                counts[tag] = counts.get(tag, 0) + 1
+        ranked = sorted(counts.values(), reverse=True)
+
+        assert ranked[0] > 20 * ranked[len(ranked) // 2]
+
+class TestRun:
+    """Test building databases and timing stages"""
+
+    @pytest.fixture(autouse=True)
+    def restore_db(self):
+        url = db.DB_URL
+        yield
+        db.close()
+        db.DB_URL = url
+
+    def test_database_generated_once(self, tmp_path):
+        path = bench.make_database(30, path=str(tmp_path))
+        os.utime(path, ns=(1, 1))
+
+        assert bench.make_database(30, path=str(tmp_path)) == path
+        assert os.stat(path).st_mtime_ns == 1
+        with bench.use_database(path) as queries:
+            assert len(list(queries.select_recent(count=100))) == 30
+
+    def test_posts_all_decodes_to_generated_links(self, tmp_path):
+        path = bench.make_posts_all(30, path=str(tmp_path))
+
+        with open(path, 'rb') as fp:
+            links = list(pinboard.iter_posts(fp))
+        generated = list(bench.generate_links(30))
+        assert [link['hash'] for link in links] == [link['hash'] for link in generated]
+        assert [link['ts'] for link in links] == [link['ts'] for link in generated]
+        assert bench.decode_posts_all(path) == 30
+
+    def test_run_times_every_stage(self, tmp_path):
+        timings = bench.run(30, repeat=2, path=str(tmp_path))
+
+        assert set(timings) == {'load_snapshot', 'create_index', 'create_archives', 'create_tags',
+                                'create_feed', 'create_recent_json', 'prepare_posts', 'decode_posts_all'}
+        assert all(seconds >= 0 for seconds in timings.values())
+        assert os.path.exists(tmp_path / 'site-30' / '_site' / 'index.html')
+        assert db.DB_URL == 'sqlite:///data.db'
+
+    def test_main_appends_results(self, tmp_path, monkeypatch, capsys):
+        monkeypatch.setattr(bench, 'BENCH_PATH', str(tmp_path))
+        monkeypatch.setattr(bench, 'run', lambda count, repeat, seed: {'create_index': 0.5})
+        results = tmp_path / 'results.jsonl'
+
+        bench.main(['--sizes', '10', '20', '--output', str(results)])
+        bench.main(['--sizes', '10', '--output', str(results)])
+
+        runs = [json.loads(line) for line in results.read_text().splitlines()]
+        assert len(runs) == 2
+        assert runs[0]['results'] == [
+            {'links': 10, 'stage': 'create_index', 'seconds': 0.5},
+            {'links': 20, 'stage': 'create_index', 'seconds': 0.5},
+        ]
+        assert 'python' in runs[0]
@@ -0,0 +1,223 @@
+# ABOUTME: Test suite for the keep-alive Pinboard API client
+# ABOUTME: Runs a local HTTP/1.1 server to test connection reuse, retries, rate limits and token redaction
+import http.server
+import json
+import socket
+import threading
+import pytest
+from blogmarks import client as client_module
+from blogmarks.client import PinboardClient, PinboardError, RateLimiter
+
+TOKEN = 'kellan:SECRET123'
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        server.connections.add(self.client_address)
+        status, headers, body = server.responses.pop(0) if server.responses else (200, {}, b'<ok/>')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.requests = []
+    server.connections = set()
+    server.responses = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def make_client(server, **kwargs):
+    clock = FakeClock()
+    kwargs.setdefault('limiter', RateLimiter(clock=clock, sleep=clock.sleep))
+    client = PinboardClient(TOKEN, url=f'http://127.0.0.1:{server.server_port}/v1/', **kwargs)
+    client.clock = clock
+    return client
+
+class TestPinboardClient:
+    """Test calls, retries and connection handling against a local server"""
+
+    def test_connection_kept_alive(self, server):
+        client = make_client(server)
+
+        for _ in range(3):
+            with client.open('posts/update') as fp:
+                assert fp.read() == b'<ok/>'
+
+        assert len(server.requests) == 3
+        assert len(server.connections) == 1
+        assert server.requests[0].startswith('/v1/posts/update?auth_token=kellan%3ASECRET123')
+
+    def test_params_encoded(self, server):
+        client = make_client(server)
+
+        with client.open('posts/get', dt='2024-01-01', tag='a b') as fp:
+            fp.read()
+
+        assert server.requests[0] == '/v1/posts/get?dt=2024-01-01&tag=a+b&auth_token=kellan%3ASECRET123'
+
+    def test_retries_server_error(self, server):
+        server.responses = [(503, {}, b'busy'), (500, {}, b'oops')]
+        client = make_client(server)
+
+        with client.open('posts/update') as fp:
+            assert fp.read() == b'<ok/>'
+
+        assert len(server.requests) == 3
+        # the 2s backoff is topped up to the limiter's 3s between calls
+        assert client.clock.sleeps == [3, 4]
+
+    def test_429_honours_retry_after(self, server):
+        server.responses = [(429, {'Retry-After': '30'}, b'slow down')]
+        client = make_client(server)
+
+        with client.open('posts/update') as fp:
+            fp.read()
+
+        assert client.clock.sleeps == [30]
+        assert len(server.requests) == 2
+
+    def test_gives_up_with_redacted_error(self, server, capsys):
+        server.responses = [(500, {}, b'oops')] * 3
+        client = make_client(server, retries=2)
+
+        with pytest.raises(PinboardError) as raised:
+            client.open('posts/update')
+
+        assert raised.value.status == 500
+        assert len(server.requests) == 3
+        assert 'SECRET123' not in str(raised.value)
+        assert 'SECRET123' not in capsys.readouterr().out
+
+    def test_client_error_not_retried(self, server):
+        server.responses = [(401, {}, b'forbidden')]
+        client = make_client(server)
+
+        with pytest.raises(PinboardError) as raised:
+            client.open('posts/update')
+
+        assert raised.value.status == 401
+        assert len(server.requests) == 1
+        assert client.clock.sleeps == []
+
+    def test_token_not_printed(self, server, capsys):
+        client = make_client(server)
+
+        with client.open('posts/update') as fp:
+            fp.read()
+
+        out = capsys.readouterr().out
+        assert 'auth_token=REDACTED' in out
+        assert 'SECRET123' not in out
+
+    def test_timeout_retried(self, server):
+        # a listening socket that never answers
+        silent = socket.socket()
+        silent.bind(('127.0.0.1', 0))
+        silent.listen()
+        clock = FakeClock()
+        client = PinboardClient(TOKEN, url=f'http://127.0.0.1:{silent.getsockname()[1]}/v1/', timeout=0.2,
+                                retries=1, limiter=RateLimiter(clock=clock, sleep=clock.sleep))
+
+        with pytest.raises(PinboardError, match='timed out'):
+            client.open('posts/update')
+
+        assert clock.sleeps == [3]
+        silent.close()
+
+    def test_half_read_response_drops_connection(self, server):
+        server.responses = [(200, {}, b'x' * 100000)]
+        client = make_client(server)
+
+        with client.open('posts/all') as fp:
+            fp.read(10)
+        with client.open('posts/update') as fp:
+            assert fp.read() == b'<ok/>'
+
+        assert len(server.connections) == 2
+
+class TestRateLimiter:
+    """Test spacing between calls"""
+
+    def test_spaces_calls(self):
+        clock = FakeClock()
+        limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+
+        limiter.wait('posts/update')
+        limiter.wait('posts/dates')
+        clock.now += 10
+        limiter.wait('posts/recent')
+        limiter.wait('posts/recent')
+
+        assert clock.sleeps == [client_module.DEFAULT_INTERVAL, client_module.INTERVALS['posts/recent']]
+
+    def test_slots_reserved_before_sleeping(self):
+        """Test callers that haven't woken yet still hold their slots"""
+        clock = FakeClock()
+        sleeps = []
+        limiter = RateLimiter(clock=clock, sleep=sleeps.append)
+
+        for _ in range(3):
+            limiter.wait('posts/get')
+
+        assert sleeps == [3, 6]
+
+    def test_threads_take_turns(self):
+        clock = FakeClock()
+        sleeps = []
+        limiter = RateLimiter(clock=clock, sleep=sleeps.append)
+
+        threads = [threading.Thread(target=limiter.wait, args=('posts/get',)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(sleeps) == [3 * i for i in range(1, 8)]
+
+    def test_back_off_holds_every_method(self):
+        clock = FakeClock()
+        limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+
+        limiter.wait('posts/get')
+        limiter.back_off(30)
+        limiter.wait('posts/dates')
+
+        assert clock.sleeps == [30]
+
+    def test_state_carries_over(self):
+        clock = FakeClock()
+        limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+        limiter.wait('posts/all')
+        clock.now += 60
+
+        later = RateLimiter(state=json.loads(json.dumps(limiter.state())), clock=clock, sleep=clock.sleep)
+        later.wait('posts/all')
+
+        assert clock.sleeps == [client_module.INTERVALS['posts/all'] - 60]
@@ -0,0 +1,172 @@
+# ABOUTME: Test suite for precompressed _site siblings
+# ABOUTME: Tests gzip siblings, skipping unchanged files, orphan cleanup and render --compress/--minify
+import pytest
+import tempfile
+import gzip
+import os
+from unittest.mock import patch
+from blogmarks import compress, db, output
+from blogmarks import render as render_module
+
+@pytest.fixture
+def temp_db():
+    """Create a temporary database for testing"""
+    temp_fd, temp_path = tempfile.mkstemp(suffix='.db')
+    os.close(temp_fd)
+
+    # Override the db module to use temp database
+    original_module_func = db.module
+    queries = db.connect(f'sqlite:///{temp_path}')
+    db.module = lambda: queries
+
+    yield temp_path
+
+    # Cleanup
+    db.module = original_module_func
+    os.unlink(temp_path)
+
+@pytest.fixture(autouse=True)
+def reset_output():
+    yield
+    output.minify = False
+    output.stats.clear()
+
+@pytest.fixture
+def site(tmp_path):
+    root = tmp_path / '_site'
+    os.makedirs(root / 'tag')
+    (root / 'index.html').write_text('<p>hello</p>' * 100)
+    (root / 'tag' / 'python.atom').write_text('<feed></feed>')
+    (root / '.manifest.json').write_text('{}')
+    return root
+
+class TestCompressSite:
+    """Test compress.compress_site"""
+
+    def test_writes_gzip_siblings(self, site):
+        assert compress.compress_site(str(site)) == 2
+
+        with gzip.open(site / 'index.html.gz') as fp:
+            assert fp.read() == (site / 'index.html').read_bytes()
+        assert (site / 'tag' / 'python.atom.gz').exists()
+        assert not (site / '.manifest.json.gz').exists()
+
+    def test_sibling_has_source_mtime(self, site):
+        compress.compress_site(str(site))
+
+        assert os.stat(site / 'index.html.gz').st_mtime_ns == os.stat(site / 'index.html').st_mtime_ns
+
+    def test_unchanged_files_not_recompressed(self, site):
+        compress.compress_site(str(site))
+
+        with patch.dict(compress.CODECS, {'gz': lambda data: pytest.fail('recompressed')}):
+            assert compress.compress_site(str(site)) == 0
+
+    def test_changed_file_recompressed(self, site):
+        compress.compress_site(str(site))
+
+        output.write_file(str(site / 'index.html'), '<p>changed</p>')
+        assert compress.compress_site(str(site)) == 1
+
+        with gzip.open(site / 'index.html.gz') as fp:
+            assert fp.read() == b'<p>changed</p>'
+
+    def test_output_is_deterministic(self, site):
+        compress.compress_site(str(site))
+        first = (site / 'index.html.gz').read_bytes()
+        os.utime(site / 'index.html', ns=(1, 1))
+
+        compress.compress_site(str(site))
+
+        assert (site / 'index.html.gz').read_bytes() == first
+
+    def test_orphaned_sibling_removed(self, site):
+        compress.compress_site(str(site))
+        os.unlink(site / 'tag' / 'python.atom')
+
+        compress.compress_site(str(site))
+
+        assert not (site / 'tag' / 'python.atom.gz').exists()
+
+    def test_stale_sibling_removed_without_codecs(self, site):
+        compress.compress_site(str(site))
+        output.write_file(str(site / 'index.html'), '<p>changed</p>')
+
+        assert compress.compress_site(str(site), codecs=()) == 0
+
+        assert not (site / 'index.html.gz').exists()
+
+    def test_unrequested_codec_removed(self, site):
+        (site / 'index.html.br').write_bytes(b'old')
+
+        compress.compress_site(str(site))
+
+        assert not (site / 'index.html.br').exists()
+        assert (site / 'index.html.gz').exists()
+
+    def test_extra_codec(self, site):
+        with patch.dict(compress.CODECS, {'rev': lambda data: data[::-1]}):
+            compress.compress_site(str(site), codecs=('gz', 'rev'))
+
+        assert (site / 'tag' / 'python.atom.rev').read_bytes() == b'>deef/<>deef<'
+
+class TestRenderOptions:
+    """Test render.main --compress and --minify"""
+
+    @pytest.fixture
+    def build(self, temp_db, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        os.symlink(os.path.join(os.path.dirname(__file__), '..', 'templates'), tmp_path / 'templates')
+        db.insert_links([{
+            'ts': 1704067200,
+            'url': 'https://example.com/a',
+            'description': 'A link',
+            'extended': 'Some text',
+            'via': None,
+            'tags': 'python',
+            'hash': 'a'
+        }])
+        return tmp_path / '_site'
+
+    def test_compress(self, build):
+        render_module.main(['--compress', 'gz'])
+
+        for name in ('index.html', 'index.atom', 'recent_links.json', '2024-01.html', 'tag/python.html'):
+            with gzip.open(build / (name + '.gz')) as fp:
+                assert fp.read() == (build / name).read_bytes()
+
+    def test_plain_build_leaves_no_stale_siblings(self, build):
+        render_module.main(['--compress', 'gz'])
+        db.insert_links([{
+            'ts': 1704153600,
+            'url': 'https://example.com/b',
+            'description': 'Another link',
+            'extended': '',
+            'via': None,
+            'tags': 'python',
+            'hash': 'b'
+        }])
+
+        render_module.main([])
+
+        assert 'example.com/b' in (build / 'index.html').read_text()
+        assert not [name for name in os.listdir(build) if name.endswith('.gz')]
+
+    def test_minify(self, build):
+        render_module.main([])
+        plain = (build / 'index.html').read_text()
+
+        render_module.main(['--minify'])
+        minified = (build / 'index.html').read_text()
+
+        assert len(minified) < len(plain)
+        assert '\n\n' not in minified and '\n ' not in minified
+        assert minified.split() == plain.split()
+        # feeds are left alone
+        assert '\n  ' in (build / 'index.atom').read_text()
+
+    def test_toggling_minify_rerenders(self, build):
+        render_module.main(['--minify'])
+        render_module.main([])
+
+        assert '\n    ' in (build / 'index.html').read_text()
@@ -14,13 +14,8 @@ def temp_db():
     
     # Override the db module to use temp database
     original_module_func = db.module
-    def temp_module():
-        queries = original_module_func()
-        queries.connect(f'sqlite:///{temp_path}')
-        queries.create_links_tables()
-        return queries
-    
-    db.module = temp_module
+    queries = db.connect(f'sqlite:///{temp_path}')
+    db.module = lambda: queries
     
     yield temp_path
     
@@ -70,6 +65,44 @@ class TestDbModule:
         for expected_col in expected_columns:
             assert expected_col in column_names
 
+class TestSharedModule:
+    """Test the process-wide cached module"""
+
+    @pytest.fixture
+    def shared_db(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(db, 'DB_URL', f'sqlite:///{tmp_path}/shared.db')
+        db.close()
+        yield tmp_path / 'shared.db'
+        db.close()
+
+    def test_module_is_cached(self, shared_db):
+        """Test that repeated module() calls return the same handle"""
+        assert db.module() is db.module()
+
+    def test_module_connects_once(self, shared_db, monkeypatch):
+        """Test that the schema setup only runs on first use"""
+        calls = []
+        original_connect = db.connect
+        def counting_connect(url):
+            calls.append(url)
+            return original_connect(url)
+        monkeypatch.setattr(db, 'connect', counting_connect)
+
+        for _ in range(5):
+            db.module().latest_ts()
+
+        assert len(calls) == 1
+        assert shared_db.exists()
+
+    def test_close_resets_module(self, shared_db):
+        """Test that close() drops the handle and module() reconnects"""
+        first = db.module()
+        db.close()
+        second = db.module()
+
+        assert first is not second
+        assert second.latest_ts() is None
+
 class TestInsertLink:
     """Test link insertion functionality"""
     
@@ -122,7 +155,7 @@ class TestInsertLink:
         assert via_result == 'tbray'
     
     def test_insert_link_upsert_behavior(self, temp_db):
-        """Test that insert_link uses upsert (insert or replace)"""
+        """Test that insert_link upserts on hash"""
         # Insert initial link
         link1 = {
             'ts': 1234567890,
@@ -159,6 +192,154 @@ class TestInsertLink:
         assert description == 'Updated description'
         assert via == 'tbray'
 
+class TestInsertLinks:
+    """Test batch link insertion"""
+
+    def make_links(self, n):
+        return [{
+            'ts': 1234567890 + i,
+            'url': f'https://example.com/{i}',
+            'description': f'Link {i}',
+            'extended': '',
+            'via': None,
+            'tags': 'test',
+            'hash': f'hash{i}'
+        } for i in range(n)]
+
+    def test_insert_links_writes_all(self, temp_db):
+        """Test that every link in the batch is written"""
+        counts = db.insert_links(self.make_links(25), batch_size=10)
+
+        conn = sqlite3.connect(temp_db)
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM links")
+        rows = cursor.fetchone()[0]
+        conn.close()
+
+        assert counts == {'inserted': 25, 'updated': 0, 'unchanged': 0}
+        assert rows == 25
+
+    def test_insert_links_accepts_generator(self, temp_db):
+        """Test that insert_links consumes any iterable"""
+        counts = db.insert_links(link for link in self.make_links(3))
+        assert counts['inserted'] == 3
+
+    def test_insert_links_empty(self, temp_db):
+        """Test that an empty batch is a no-op"""
+        assert db.insert_links([]) == {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    def test_insert_links_counts_updates_and_unchanged(self, temp_db):
+        """Test that re-inserting reports updated and unchanged rows"""
+        db.insert_links(self.make_links(10))
+
+        links = self.make_links(12)
+        links[0]['description'] = 'Edited'
+        links[1]['tags'] = 'test edited'
+        counts = db.insert_links(links, batch_size=5)
+
+        assert counts == {'inserted': 2, 'updated': 2, 'unchanged': 8}
+
+    def test_insert_links_preserves_id(self, temp_db):
+        """Test that an update keeps the row's id instead of reinserting"""
+        links = self.make_links(3)
+        db.insert_links(links)
+
+        conn = sqlite3.connect(temp_db)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM links WHERE hash = 'hash1'")
+        original_id = cursor.fetchone()[0]
+        conn.close()
+
+        links[1]['extended'] = 'Now with extended text'
+        db.insert_links(links)
+
+        conn = sqlite3.connect(temp_db)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, extended FROM links WHERE hash = 'hash1'")
+        updated_id, extended = cursor.fetchone()
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'links'")
+        seq = cursor.fetchone()[0]
+        conn.close()
+
+        assert updated_id == original_id
+        assert extended == 'Now with extended text'
+        assert seq == 3  # no autoincrement ids burned
+
+    def test_insert_links_unchanged_leaves_file_alone(self, temp_db):
+        """Test that re-fetching the same links does not modify the database file"""
+        links = self.make_links(20)
+        db.insert_links(links)
+
+        with open(temp_db, 'rb') as fp:
+            before = fp.read()
+
+        counts = db.insert_links(self.make_links(20))
+
+        with open(temp_db, 'rb') as fp:
+            after = fp.read()
+
+        assert counts == {'inserted': 0, 'updated': 0, 'unchanged': 20}
+        assert before == after
+
+    def test_insert_links_rolls_back_on_error(self, temp_db):
+        """Test that a bad link aborts the whole batch"""
+        links = self.make_links(5)
+        del links[3]['hash']
+
+        with pytest.raises(Exception):
+            db.insert_links(links, batch_size=2)
+
+        conn = sqlite3.connect(temp_db)
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM links")
+        rows = cursor.fetchone()[0]
+        conn.close()
+
+        assert rows == 0
+
+class TestDatabaseState:
+    """Test db.database_state and the links_changes counter"""
+
+    def make_link(self, hash_value, description='A link'):
+        return {
+            'ts': 1234567890,
+            'url': f'https://example.com/{hash_value}',
+            'description': description,
+            'extended': '',
+            'via': None,
+            'tags': 'test',
+            'hash': hash_value
+        }
+
+    def test_empty_database(self, temp_db):
+        assert db.database_state(db.module()) == {'count': 0, 'max_id': None, 'max_ts': None, 'changes': 0}
+
+    def test_every_write_changes_state(self, temp_db):
+        queries = db.module()
+        db.insert_links([self.make_link('a'), self.make_link('b')])
+        inserted = db.database_state(queries)
+
+        db.insert_links([self.make_link('a', 'Edited')])
+        edited = db.database_state(queries)
+
+        conn = sqlite3.connect(temp_db)
+        conn.execute("DELETE FROM links WHERE hash = 'b'")
+        conn.commit()
+        conn.close()
+        deleted = db.database_state(queries)
+
+        assert inserted == {'count': 2, 'max_id': 2, 'max_ts': 1234567890, 'changes': 2}
+        assert edited['changes'] == 3 and edited['count'] == 2
+        assert deleted['changes'] == 4 and deleted['count'] == 1
+
+    def test_unchanged_links_leave_state_alone(self, temp_db):
+        db.insert_links([self.make_link('a')])
+        before = db.database_state(db.module())
+
+        db.insert_links([self.make_link('a')])
+
+        assert db.database_state(db.module()) == before
+
 class TestDatabaseQueries:
     """Test SQL queries work correctly"""
     
@@ -244,47 +425,182 @@ class TestDatabaseQueries:
         assert results[0]['ts'] == 1234567900
         assert results[1]['ts'] == 1234567890
     
-    def test_distinct_year_months(self, temp_db):
-        """Test distinct_year_months query"""
-        # Insert links from different months
+    def test_stream_by_year_month_boundaries(self, temp_db):
+        """Test stream_by_year_month covers exactly one UTC month, newest first"""
         links = [
-            {
-                'ts': 1704067200,  # 2024-01-01
-                'url': 'https://jan.com',
-                'description': 'January link',
-                'extended': '',
-                'via': None,
-                'tags': 'test',
-                'hash': 'jan'
-            },
-            {
-                'ts': 1706745600,  # 2024-02-01
-                'url': 'https://feb.com',
-                'description': 'February link',
-                'extended': '',
-                'via': None,
-                'tags': 'test',
-                'hash': 'feb'
-            },
-            {
-                'ts': 1704153600,  # Another January date
-                'url': 'https://jan2.com',
-                'description': 'Another January link',
+            (1704067199, 'dec_last_second'),  # 2023-12-31 23:59:59 UTC
+            (1704067200, 'jan_first_second'),  # 2024-01-01 00:00:00 UTC
+            (1705000000, 'jan_middle'),
+            (1706745599, 'jan_last_second'),  # 2024-01-31 23:59:59 UTC
+            (1706745600, 'feb_first_second'),  # 2024-02-01 00:00:00 UTC
+        ]
+        for ts, hash_value in links:
+            db.insert_link({
+                'ts': ts,
+                'url': f'https://example.com/{hash_value}',
+                'description': hash_value,
                 'extended': '',
                 'via': None,
                 'tags': 'test',
-                'hash': 'jan2'
-            }
-        ]
-        
-        for link in links:
-            db.insert_link(link)
-        
+                'hash': hash_value
+            })
+
         queries = db.module()
-        results = list(queries.distinct_year_months())
-        
-        # Should return unique year-month combinations
-        year_months = [r['year_month'] for r in results]
-        assert '2024-01' in year_months
-        assert '2024-02' in year_months
-        assert len(year_months) == 2  # Should be distinct
\ No newline at end of file
+        results = list(db.iter_rows(queries.stream_by_year_month(year_month='2024-01')))
+
+        assert [r['hash'] for r in results] == ['jan_last_second', 'jan_middle', 'jan_first_second']
+
+    def test_stream_by_year_month_uses_ts_index(self, temp_db):
+        """Test the month query is a range search on the ts index, not a scan"""
+        queries = db.module()
+
+        conn = sqlite3.connect(temp_db)
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='links'")
+        indexes = {row[0] for row in cursor.fetchall()}
+        cursor.execute(
+            "EXPLAIN QUERY PLAN " + queries.stream_by_year_month.sql,
+            {'year_month': '2024-01'}
+        )
+        plan = ' '.join(row[-1] for row in cursor.fetchall())
+        conn.close()
+
+        assert 'links_ts' in indexes
+        assert 'links_year_month' not in indexes
+        assert 'SEARCH' in plan and 'links_ts' in plan
+
+    def test_stream_page_uses_ts_index(self, temp_db):
+        """Test a page's keyset query seeks into the ts index rather than skipping rows"""
+        queries = db.module()
+
+        conn = sqlite3.connect(temp_db)
+        cursor = conn.cursor()
+        cursor.execute(
+            "EXPLAIN QUERY PLAN " + queries.stream_page.sql,
+            {'ts': 1704067200, 'id': 10, 'count': 100}
+        )
+        plan = ' '.join(row[-1] for row in cursor.fetchall())
+        conn.close()
+
+        assert 'SEARCH' in plan and 'links_ts' in plan
+        assert 'TEMP B-TREE' not in plan
+
+class TestLinkTags:
+    """Test the normalized link_tags index"""
+
+    def make_link(self, hash_value, tags, ts=1234567890):
+        return {
+            'ts': ts,
+            'url': f'https://example.com/{hash_value}',
+            'description': hash_value,
+            'extended': '',
+            'via': None,
+            'tags': tags,
+            'hash': hash_value
+        }
+
+    def stored_tags(self, temp_db, hash_value):
+        conn = sqlite3.connect(temp_db)
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT t.tag FROM link_tags t JOIN links l ON l.id = t.link_id "
+            "WHERE l.hash = ? ORDER BY t.tag", (hash_value,))
+        tags = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return tags
+
+    def test_split_tags(self):
+        """Test tag splitting drops blanks, markers and duplicates"""
+        assert db.split_tags('python  + coding - python') == ['python', 'coding']
+        assert db.split_tags('') == []
+        assert db.split_tags(None) == []
+
+    def test_insert_populates_link_tags(self, temp_db):
+        """Test that inserted links get one link_tags row per tag"""
+        db.insert_links([self.make_link('a', 'python coding'), self.make_link('b', '')])
+
+        assert self.stored_tags(temp_db, 'a') == ['coding', 'python']
+        assert self.stored_tags(temp_db, 'b') == []
+
+    def test_retag_replaces_link_tags(self, temp_db):
+        """Test that changing a link's tags rewrites its link_tags rows"""
+        db.insert_links([self.make_link('a', 'python coding')])
+        db.insert_links([self.make_link('a', 'python sqlite')])
+
+        assert self.stored_tags(temp_db, 'a') == ['python', 'sqlite']
+
+    def test_stream_by_tag(self, temp_db):
+        """Test links-by-tag lookup, newest first"""
+        db.insert_links([
+            self.make_link('a', 'python coding', ts=100),
+            self.make_link('b', 'python', ts=300),
+            self.make_link('c', 'coding', ts=200),
+        ])
+
+        queries = db.module()
+        results = list(db.iter_rows(queries.stream_by_tag(tag='python')))
+
+        assert [r['hash'] for r in results] == ['b', 'a']
+
+    def test_tag_counts(self, temp_db):
+        """Test tag counts, most used first"""
+        db.insert_links([
+            self.make_link('a', 'python coding'),
+            self.make_link('b', 'python'),
+            self.make_link('c', 'sqlite python'),
+        ])
+
+        queries = db.module()
+        counts = [(r['tag'], r['count']) for r in queries.tag_counts()]
+
+        assert counts == [('python', 3), ('coding', 1), ('sqlite', 1)]
+
+    def test_stream_by_tag_uses_index(self, temp_db):
+        """Test a tag's links are found through link_tags, not by scanning links"""
+        queries = db.module()
+
+        conn = sqlite3.connect(temp_db)
+        cursor = conn.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + queries.stream_by_tag.sql, {'tag': 'python'})
+        plan = ' '.join(row[-1] for row in cursor.fetchall())
+        conn.close()
+
+        assert 'SEARCH t USING COVERING INDEX link_tags_tag' in plan
+        assert 'SCAN l' not in plan
+
+    def test_year_month_index_dropped(self, tmp_path):
+        """Test that opening a version 3 database drops the unused month index"""
+        path = tmp_path / 'v3.db'
+        db.connect(f'sqlite:///{path}')
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE INDEX links_year_month ON links (strftime('%Y-%m', ts, 'unixepoch'))")
+        conn.execute('PRAGMA user_version = 3')
+        conn.commit()
+        conn.close()
+
+        queries = db.connect(f'sqlite:///{path}')
+
+        conn = sqlite3.connect(path)
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+        conn.close()
+        assert queries.schema_version() == db.SCHEMA_VERSION
+        assert 'links_year_month' not in indexes
+
+    def test_existing_links_backfilled(self, tmp_path):
+        """Test that opening an older database backfills link_tags once"""
+        path = tmp_path / 'old.db'
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE links (id integer primary key autoincrement, ts integer, url text, "
+            "description text, extended text, via text, tags text, hash text unique)")
+        conn.execute(
+            "INSERT INTO links (ts, url, description, extended, via, tags, hash) "
+            "VALUES (1, 'https://example.com', 'Old', '', NULL, 'python coding', 'old')")
+        conn.commit()
+        conn.close()
+
+        queries = db.connect(f'sqlite:///{path}')
+
+        assert queries.schema_version() == db.SCHEMA_VERSION
+        assert [r['hash'] for r in db.iter_rows(queries.stream_by_tag(tag='coding'))] == ['old']
+        assert db.database_state(queries)['changes'] == 0
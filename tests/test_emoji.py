@@ -17,13 +17,8 @@ def temp_db():
     os.close(temp_fd)
 
     original_module_func = db.module
-    def temp_module():
-        queries = original_module_func()
-        queries.connect(f'sqlite:///{temp_path}')
-        queries.create_links_tables()
-        return queries
-
-    db.module = temp_module
+    queries = db.connect(f'sqlite:///{temp_path}')
+    db.module = lambda: queries
 
     yield temp_path
 
@@ -0,0 +1,149 @@
+# ABOUTME: Test suite for the per-link rendered fragment cache
+# ABOUTME: Tests fragment reuse, invalidation on link and template edits, and --fragments builds
+import pytest
+import tempfile
+import os
+from blogmarks import db
+from blogmarks import render as render_module
+from blogmarks.fragments import FragmentCache
+from blogmarks.render import make_env
+
+@pytest.fixture
+def temp_db():
+    """Create a temporary database for testing"""
+    temp_fd, temp_path = tempfile.mkstemp(suffix='.db')
+    os.close(temp_fd)
+
+    # Override the db module to use temp database
+    original_module_func = db.module
+    queries = db.connect(f'sqlite:///{temp_path}')
+    db.module = lambda: queries
+
+    yield temp_path
+
+    # Cleanup
+    db.module = original_module_func
+    os.unlink(temp_path)
+
+@pytest.fixture
+def templates(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('templates')
+    with open('templates/_item.html', 'w') as fp:
+        fp.write('{% macro render(link) %}<li>{{ link.description }}</li>{% endmacro %}')
+    return tmp_path
+
+def make_link(hash_value, description=None, ts=1704067200):
+    return {
+        'ts': ts,
+        'url': f'https://example.com/{hash_value}',
+        'description': description or hash_value,
+        'extended': '',
+        'via': None,
+        'tags': 'test',
+        'hash': hash_value
+    }
+
+def rendered_count(cache):
+    """Stand in for _item.html's macro, recording each link Jinja would render"""
+    calls = []
+    cache.templates['_item.html'] = lambda link: calls.append(link['hash']) or 'rendered'
+    return calls
+
+class TestFragmentCache:
+    """Test FragmentCache"""
+
+    def test_renders_and_reuses_fragment(self, templates):
+        cache = FragmentCache(make_env(cache_path=None), path='cache/fragments.db')
+        assert cache.render('_item.html', make_link('a')) == '<li>a</li>'
+        cache.close()
+
+        cache = FragmentCache(make_env(cache_path=None), path='cache/fragments.db')
+        rendered = rendered_count(cache)
+
+        assert cache.render('_item.html', make_link('a')) == '<li>a</li>'
+        assert rendered == []
+
+    def test_edited_link_is_rendered_again(self, templates):
+        cache = FragmentCache(make_env(cache_path=None), path='cache/fragments.db')
+        cache.render('_item.html', make_link('a'))
+        cache.flush()
+
+        assert cache.render('_item.html', make_link('a', 'Edited')) == '<li>Edited</li>'
+
+    def test_template_edit_invalidates(self, templates):
+        cache = FragmentCache(make_env(cache_path=None), path='cache/fragments.db')
+        cache.render('_item.html', make_link('a'))
+        cache.close()
+
+        with open('templates/_item.html', 'w') as fp:
+            fp.write('{% macro render(link) %}<p>{{ link.description }}</p>{% endmacro %}')
+        cache = FragmentCache(make_env(cache_path=None), path='cache/fragments.db')
+
+        assert cache.render('_item.html', make_link('a')) == '<p>a</p>'
+
+    def test_preload_batches_lookups(self, templates):
+        cache = FragmentCache(make_env(cache_path=None), path='cache/fragments.db')
+        links = [make_link(f'h{i}') for i in range(5)]
+        for link in links:
+            cache.render('_item.html', link)
+        cache.flush()
+        rendered = rendered_count(cache)
+
+        markup = [cache.render('_item.html', link) for link in cache.preload(iter(links))]
+
+        assert markup == [f'<li>h{i}</li>' for i in range(5)]
+        assert rendered == []
+        assert cache.loaded == {}
+
+    def test_one_row_per_link_and_template(self, templates):
+        cache = FragmentCache(make_env(cache_path=None), path='cache/fragments.db')
+        for description in ('one', 'two', 'three'):
+            cache.render('_item.html', make_link('a', description))
+            cache.flush()
+
+        assert cache.connect().execute('select count(*) from fragments').fetchone()[0] == 1
+
+class TestFragmentBuild:
+    """Test render.main with --fragments"""
+
+    def build(self, root, argv):
+        os.makedirs(root, exist_ok=True)
+        if not os.path.exists(os.path.join(root, 'templates')):
+            os.symlink(os.path.join(os.path.dirname(__file__), '..', 'templates'), os.path.join(root, 'templates'))
+        cwd = os.getcwd()
+        os.chdir(root)
+        try:
+            render_module.main(argv)
+        finally:
+            os.chdir(cwd)
+        site = os.path.join(root, '_site')
+        contents = {}
+        for directory, _, names in os.walk(site):
+            for name in names:
+                path = os.path.join(directory, name)
+                if name != '.manifest.json':
+                    with open(path, 'rb') as fp:
+                        contents[os.path.relpath(path, site)] = fp.read()
+        return contents
+
+    def test_output_matches_plain_build(self, temp_db, tmp_path):
+        """Test pages assembled from fragments are byte-identical, cold and warm"""
+        db.insert_links([{
+            'ts': 1704067200 + i * 5 * 86400,
+            'url': f'https://example.com/{i}',
+            'description': f'Link {i}',
+            'extended': f'Extended {i}',
+            'via': 'https://waxy.org/' if i % 5 == 0 else None,
+            'tags': 'python quotable' if i % 4 == 0 else 'python',
+            'hash': f'hash{i}'
+        } for i in range(40)])
+
+        plain = self.build(str(tmp_path / 'plain'), [])
+        cold = self.build(str(tmp_path / 'cached'), ['--fragments'])
+        os.unlink(tmp_path / 'cached' / '_site' / '.manifest.json')
+        warm = self.build(str(tmp_path / 'cached'), ['--fragments', '--jobs', '2'])
+
+        assert cold == plain
+        assert warm == plain
+        assert (tmp_path / 'cached' / '.cache' / 'fragments.db').exists()
@@ -0,0 +1,326 @@
+# ABOUTME: Test suite for the build manifest and incremental rendering
+# ABOUTME: Tests fingerprints, manifest persistence and that unchanged months aren't re-rendered
+import pytest
+import tempfile
+import os
+from unittest.mock import patch
+from blogmarks import db, manifest
+from blogmarks import render as render_module
+
+TEMPLATES = os.path.join(os.path.dirname(__file__), '..', 'templates')
+
+@pytest.fixture
+def temp_db():
+    """Create a temporary database for testing"""
+    temp_fd, temp_path = tempfile.mkstemp(suffix='.db')
+    os.close(temp_fd)
+
+    # Override the db module to use temp database
+    original_module_func = db.module
+    queries = db.connect(f'sqlite:///{temp_path}')
+    db.module = lambda: queries
+
+    yield temp_path
+
+    # Cleanup
+    db.module = original_module_func
+    os.unlink(temp_path)
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    """Run the build in a scratch directory with a copy of the templates"""
+    monkeypatch.chdir(tmp_path)
+    os.mkdir(tmp_path / 'templates')
+    for name in os.listdir(TEMPLATES):
+        with open(os.path.join(TEMPLATES, name)) as src, open(tmp_path / 'templates' / name, 'w') as dst:
+            dst.write(src.read())
+    return tmp_path / '_site'
+
+def make_link(hash_value, ts, description=None):
+    return {
+        'ts': ts,
+        'url': f'https://example.com/{hash_value}',
+        'description': description or hash_value,
+        'extended': '',
+        'via': None,
+        'tags': 'test',
+        'hash': hash_value
+    }
+
+def mtimes(site):
+    return {name: os.stat(site / name).st_mtime_ns for name in os.listdir(site)}
+
+def touch_all(site):
+    """Backdate every output so a rewrite shows up as an mtime change"""
+    for name in os.listdir(site):
+        os.utime(site / name, ns=(1, 1))
+
+class TestFingerprint:
+    """Test output fingerprints"""
+
+    def test_same_data_same_fingerprint(self, site):
+        assert manifest.fingerprint({'a': [1, 2]}) == manifest.fingerprint({'a': [1, 2]})
+
+    def test_data_changes_fingerprint(self, site):
+        assert manifest.fingerprint({'a': [1, 2]}) != manifest.fingerprint({'a': [1, 3]})
+
+    def test_template_edit_changes_fingerprint(self, site):
+        before = manifest.fingerprint({'a': 1}, 'links.html')
+        with open('templates/links.html', 'a') as fp:
+            fp.write('\n')
+        assert manifest.fingerprint({'a': 1}, 'links.html') != before
+
+    def test_other_template_edit_leaves_fingerprint(self, site):
+        before = manifest.fingerprint({'a': 1}, 'atom.xml')
+        with open('templates/links.html', 'a') as fp:
+            fp.write('\n')
+        assert manifest.fingerprint({'a': 1}, 'atom.xml') == before
+
+class TestTemplateDependencies:
+    """Test the template dependency graph behind output fingerprints"""
+
+    def test_dependencies(self):
+        source = ('{% extends "base.html" %}{% import "macros.html" as m %}'
+                  '{% from "forms.html" import field %}{% include "footer.html" %}'
+                  "{{ fragment('_link.html', link) }}")
+        assert manifest.template_dependencies(source) == {
+            'base.html', 'macros.html', 'forms.html', 'footer.html', '_link.html'}
+
+    def test_dynamic_dependency(self):
+        assert manifest.template_dependencies('{% include name %}') == {None}
+        assert manifest.template_dependencies('{{ fragment(name, link) }}') == {None}
+
+    def edit(self, name):
+        with open(f'templates/{name}', 'a') as fp:
+            fp.write('\n')
+
+    def changed(self, name):
+        before = manifest.template_fingerprints()
+        self.edit(name)
+        after = manifest.template_fingerprints()
+        return {template for template in after if after[template] != before[template]}
+
+    def test_base_edit(self, site):
+        assert self.changed('base.html') == {'base.html', 'links.html', 'archive.html', 'tags.html'}
+
+    def test_fragment_edit(self, site):
+        assert self.changed('_link.html') == {'_link.html', 'links.html'}
+        assert self.changed('_entry.xml') == {'_entry.xml', 'atom.xml'}
+
+    def test_leaf_edit(self, site):
+        assert self.changed('archive.html') == {'archive.html'}
+
+    def test_dynamic_dependency_depends_on_everything(self, site):
+        with open('templates/dynamic.html', 'w') as fp:
+            fp.write('{% include page.template %}')
+
+        assert 'dynamic.html' in self.changed('_entry.xml')
+
+class TestManifestFile:
+    """Test manifest persistence"""
+
+    def test_missing_manifest_is_empty(self, site):
+        assert manifest.load_manifest() == {}
+
+    def test_corrupt_manifest_is_empty(self, site):
+        os.makedirs(site)
+        with open(manifest.MANIFEST_PATH, 'w') as fp:
+            fp.write('{not json')
+        assert manifest.load_manifest() == {}
+
+    def test_round_trip(self, site):
+        manifest.save_manifest({'_site/index.html': 'abc'})
+        assert manifest.load_manifest() == {'_site/index.html': 'abc'}
+
+    def test_is_current_requires_file(self, site):
+        m = {'_site/index.html': 'abc'}
+        assert not manifest.is_current(m, '_site/index.html', 'abc')
+
+class TestPrune:
+    """Test outputs the last build made and this one didn't are deleted"""
+
+    def test_prune_deletes_unproduced(self, site):
+        os.makedirs(site / 'tag' / 'zzz')
+        for name in ('index.html', 'tag/zzz.html', 'tag/zzz/1.html'):
+            (site / name).write_text('x')
+        m = {'_site/index.html': 'a', '_site/tag/zzz.html': 'b', '_site/tag/zzz/1.html': 'c', '_site/gone.html': 'd'}
+
+        removed = manifest.prune(m, {'_site/index.html'})
+
+        assert removed == ['_site/gone.html', '_site/tag/zzz.html', '_site/tag/zzz/1.html']
+        assert m == {'_site/index.html': 'a'}
+        assert (site / 'index.html').exists()
+        # directories emptied go too, but not _site itself
+        assert not (site / 'tag').exists()
+        assert site.is_dir()
+
+    def test_retagged_tag_removed(self, temp_db, site, capsys):
+        link = make_link('a', 1704153600)
+        db.insert_links([dict(link, tags='zzz'), make_link('b', 1704153601)])
+        render_module.main([])
+
+        db.insert_links([dict(link, tags='yyy')])
+        render_module.main([])
+
+        assert not (site / 'tag' / 'zzz.html').exists()
+        assert not (site / 'tag' / 'zzz.atom').exists()
+        assert (site / 'tag' / 'yyy.html').exists()
+        built = manifest.load_manifest()
+        assert '_site/tag/zzz.html' not in built and '_site/tag/zzz.atom' not in built
+        assert 'removed 2 no longer built' in capsys.readouterr().out
+
+    def test_page_size_change_removes_surplus_pages(self, temp_db, site):
+        db.insert_links([make_link(f'h{i}', 1704153600 + i) for i in range(7)])
+        render_module.main(['--page-size', '2'])
+        assert (site / 'page' / '4.html').exists()
+
+        render_module.main(['--page-size', '3'])
+
+        assert sorted(os.listdir(site / 'page')) == ['1.html', '2.html', '3.html']
+        assert '_site/page/4.html' not in manifest.load_manifest()
+
+class TestIncrementalRender:
+    """Test that main() only re-renders outputs whose inputs changed"""
+
+    def test_second_build_renders_nothing(self, temp_db, site):
+        db.insert_links([make_link('jan', 1704153600), make_link('feb', 1706832000)])
+        render_module.main([])
+        touch_all(site)
+
+        render_module.main([])
+
+        changed = [name for name, mtime in mtimes(site).items() if mtime != 1]
+        assert changed == []
+
+    def test_only_changed_month_rendered(self, temp_db, site):
+        db.insert_links([
+            make_link('jan', 1704153600),  # 2024-01-02
+            make_link('feb', 1706832000),  # 2024-02-02
+            make_link('mar', 1709337600),  # 2024-03-02
+        ])
+        render_module.main([])
+        touch_all(site)
+
+        db.insert_links([make_link('jan', 1704153600, description='Edited January link')])
+        render_module.main([])
+
+        times = mtimes(site)
+        assert times['2024-01.html'] != 1
+        assert times['2024-02.html'] == 1
+        assert times['2024-03.html'] == 1
+        assert times['archive.html'] == 1
+        assert 'Edited January link' in (site / '2024-01.html').read_text()
+
+    def test_new_month_renders_archive_index(self, temp_db, site):
+        db.insert_links([make_link('jan', 1704153600)])
+        render_module.main([])
+        touch_all(site)
+
+        db.insert_links([make_link('feb', 1706832000)])
+        render_module.main([])
+
+        times = mtimes(site)
+        assert times['2024-01.html'] == 1
+        assert times['2024-02.html'] != 1
+        assert times['archive.html'] != 1
+        assert times['index.html'] != 1
+
+    def test_template_change_renders_everything(self, temp_db, site):
+        db.insert_links([make_link('jan', 1704153600), make_link('feb', 1706832000)])
+        render_module.main([])
+        touch_all(site)
+
+        with open('templates/base.html', 'a') as fp:
+            fp.write('<!-- footer -->')
+        render_module.main([])
+
+        times = mtimes(site)
+        assert all(times[name] != 1 for name in times if name.endswith('.html'))
+        # rendered again, but their bytes don't depend on base.html
+        assert times['index.atom'] == 1
+        assert times['recent_links.json'] == 1
+
+    def test_feed_template_change_renders_feeds(self, temp_db, site):
+        db.insert_links([make_link('jan', 1704153600), make_link('feb', 1706832000)])
+        render_module.main([])
+        touch_all(site)
+
+        with open('templates/atom.xml', 'a') as fp:
+            fp.write('<!-- feed -->')
+        with patch.object(render_module, 'render_month') as render_month:
+            render_module.main([])
+
+        render_month.assert_not_called()
+        times = mtimes(site)
+        assert times['index.atom'] != 1
+        assert os.stat(site / 'tag' / 'test.atom').st_mtime_ns != 1
+        assert all(times[name] == 1 for name in times if name.endswith('.html'))
+
+    def test_archive_template_change_renders_archive(self, temp_db, site):
+        db.insert_links([make_link('jan', 1704153600), make_link('feb', 1706832000)])
+        render_module.main([])
+        touch_all(site)
+
+        with open('templates/archive.html', 'a') as fp:
+            fp.write('<!-- archive -->')
+        with patch.object(render_module, 'render', wraps=render_module.render) as render, \
+                patch.object(render_module, 'render_stream') as render_stream, \
+                patch.object(render_module, 'render_month') as render_month:
+            render_module.main([])
+
+        assert [call.args[0] for call in render.call_args_list] == ['archive.html']
+        render_stream.assert_not_called()
+        render_month.assert_not_called()
+
+    def test_deleted_output_is_rebuilt(self, temp_db, site):
+        db.insert_links([make_link('jan', 1704153600)])
+        render_module.main([])
+
+        os.unlink(site / '2024-01.html')
+        render_module.main([])
+
+        assert (site / '2024-01.html').exists()
+
+class TestBuildState:
+    """Test that main() stops early when nothing the build reads has changed"""
+
+    @pytest.fixture
+    def built(self, temp_db, site):
+        db.insert_links([make_link('jan', 1704153600), make_link('feb', 1706832000)])
+        render_module.main([])
+        touch_all(site)
+        return site
+
+    def rebuilt(self, argv=()):
+        with patch.object(render_module, 'build_site', wraps=render_module.build_site) as build_site:
+            render_module.main(list(argv))
+        return build_site.called
+
+    def test_unchanged_build_stops_early(self, built, capsys):
+        capsys.readouterr()
+        with patch.object(db.module(), 'stream_links') as stream_links:
+            render_module.main([])
+
+        stream_links.assert_not_called()
+        assert 'Nothing changed' in capsys.readouterr().out
+        assert all(mtime == 1 for mtime in mtimes(built).values())
+
+    def test_force(self, built):
+        assert self.rebuilt(['--force'])
+
+    def test_edited_link(self, built):
+        db.insert_links([make_link('jan', 1704153600, description='Edited')])
+        assert self.rebuilt()
+
+    def test_template_edit(self, built):
+        with open('templates/archive.html', 'a') as fp:
+            fp.write('\n')
+        assert self.rebuilt()
+
+    def test_option_change(self, built):
+        assert self.rebuilt(['--page-size', '1'])
+        assert not self.rebuilt(['--page-size', '1'])
+
+    def test_missing_state(self, built):
+        os.unlink(manifest.STATE_PATH)
+        assert self.rebuilt()
@@ -0,0 +1,146 @@
+# ABOUTME: Test suite for the atomic, skip-unchanged _site file writer
+# ABOUTME: Tests byte comparison, temp-file-then-rename writes, permissions and counts
+import pytest
+import os
+from unittest.mock import patch
+from blogmarks import output
+
+@pytest.fixture(autouse=True)
+def clear_stats():
+    output.stats.clear()
+    yield
+    output.stats.clear()
+    output.minify = False
+
+class TestWriteFile:
+    """Test output.write_file"""
+
+    def test_writes_new_file(self, tmp_path):
+        path = str(tmp_path / '_site' / 'index.html')
+
+        assert output.write_file(path, '<p>hello 🚀</p>') is True
+
+        with open(path, encoding='utf-8') as fp:
+            assert fp.read() == '<p>hello 🚀</p>'
+        assert output.stats['written'] == 1
+        assert output.stats['bytes'] == len('<p>hello 🚀</p>'.encode('utf-8'))
+
+    def test_skips_identical_content(self, tmp_path):
+        path = str(tmp_path / 'index.html')
+        output.write_file(path, 'same')
+        os.utime(path, ns=(1, 1))
+
+        assert output.write_file(path, 'same') is False
+
+        assert os.stat(path).st_mtime_ns == 1
+        assert output.stats['written'] == 1
+        assert output.stats['skipped'] == 1
+
+    def test_rewrites_changed_content(self, tmp_path):
+        path = str(tmp_path / 'index.html')
+        output.write_file(path, 'old')
+
+        assert output.write_file(path, 'new') is True
+
+        with open(path) as fp:
+            assert fp.read() == 'new'
+
+    def test_accepts_bytes(self, tmp_path):
+        path = str(tmp_path / 'data.bin')
+        output.write_file(path, b'\x00\x01')
+
+        with open(path, 'rb') as fp:
+            assert fp.read() == b'\x00\x01'
+
+    def test_new_files_are_world_readable(self, tmp_path):
+        path = str(tmp_path / 'index.html')
+        output.write_file(path, 'x')
+
+        assert os.stat(path).st_mode & 0o777 == 0o644
+
+    def test_keeps_existing_mode(self, tmp_path):
+        path = str(tmp_path / 'index.html')
+        output.write_file(path, 'x')
+        os.chmod(path, 0o664)
+
+        output.write_file(path, 'y')
+
+        assert os.stat(path).st_mode & 0o777 == 0o664
+
+    def test_streams_chunks(self, tmp_path):
+        path = str(tmp_path / 'index.html')
+
+        assert output.write_file(path, (f'<p>{i}</p>' for i in range(3))) is True
+
+        with open(path) as fp:
+            assert fp.read() == '<p>0</p><p>1</p><p>2</p>'
+        assert output.stats['bytes'] == 24
+
+    def test_skips_identical_stream(self, tmp_path):
+        path = str(tmp_path / 'index.html')
+        output.write_file(path, 'abc')
+        os.utime(path, ns=(1, 1))
+
+        assert output.write_file(path, iter(['a', 'b', 'c'])) is False
+
+        assert os.stat(path).st_mtime_ns == 1
+        assert output.stats['skipped'] == 1
+        assert os.listdir(tmp_path) == ['index.html']
+
+    def test_failed_stream_leaves_old_file(self, tmp_path):
+        """An exception mid-render must not touch the published file"""
+        path = str(tmp_path / 'index.html')
+        output.write_file(path, 'complete page')
+
+        def chunks():
+            yield 'half a '
+            raise RuntimeError('template error')
+
+        with pytest.raises(RuntimeError):
+            output.write_file(path, chunks())
+
+        with open(path) as fp:
+            assert fp.read() == 'complete page'
+        assert os.listdir(tmp_path) == ['index.html']
+
+    def test_failed_write_leaves_old_file(self, tmp_path):
+        """A crash mid-write must not truncate the published file"""
+        path = str(tmp_path / 'index.html')
+        output.write_file(path, 'complete page')
+
+        with patch('blogmarks.output.os.replace', side_effect=OSError('disk full')):
+            with pytest.raises(OSError):
+                output.write_file(path, 'half a page')
+
+        with open(path) as fp:
+            assert fp.read() == 'complete page'
+        assert os.listdir(tmp_path) == ['index.html']
+
+    def test_minify_html(self, tmp_path):
+        output.minify = True
+        path = str(tmp_path / 'index.html')
+
+        output.write_file(path, iter(['<div>\n    <p>one', '</p>\n\n   ', ' <p>two</p>\n</div>']))
+
+        with open(path) as fp:
+            assert fp.read() == '<div>\n<p>one</p>\n<p>two</p>\n</div>'
+
+    def test_minify_only_html(self, tmp_path):
+        output.minify = True
+        path = str(tmp_path / 'index.atom')
+
+        output.write_file(path, '<feed>\n  <entry/>\n</feed>')
+
+        with open(path) as fp:
+            assert fp.read() == '<feed>\n  <entry/>\n</feed>'
+
+class TestFileDigest:
+    """Test output.file_digest"""
+
+    def test_missing_file(self, tmp_path):
+        assert output.file_digest(str(tmp_path / 'nope')) is None
+
+    def test_digest_matches_content(self, tmp_path):
+        path = str(tmp_path / 'a')
+        output.write_file(path, 'abc')
+        assert output.file_digest(path) == 'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad'
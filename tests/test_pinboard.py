@@ -1,13 +1,18 @@
 # ABOUTME: Comprehensive test suite for pinboard.py functions
-# ABOUTME: Tests link fetching, processing, date/via tag handling, and database operations
+# ABOUTME: Tests link fetching, streaming and edit-aware sync, date/via tag handling, and database operations
 import pytest
 import tempfile
+import io
 import os
 import sqlite3
 from unittest.mock import patch, MagicMock
-from blogmarks.pinboard import iso_to_unix, munge_link, add_links
-from blogmarks import db
+from blogmarks.pinboard import (iso_to_unix, munge_link, add_links, iter_posts, fetch_all, sync_all, unix_to_iso,
+                                main, reconcile, sync_recent, sync_range, fetch_days, fetch_recent)
+from blogmarks import db, pinboard as pinboard_module
 import datetime
+import iso8601
+import time
+import json
 
 @pytest.fixture
 def temp_db():
@@ -17,13 +22,8 @@ def temp_db():
     
     # Override the db module to use temp database
     original_module_func = db.module
-    def temp_module():
-        queries = original_module_func()
-        queries.connect(f'sqlite:///{temp_path}')
-        queries.create_links_tables()
-        return queries
-    
-    db.module = temp_module
+    queries = db.connect(f'sqlite:///{temp_path}')
+    db.module = lambda: queries
     
     yield temp_path
     
@@ -33,6 +33,10 @@ def temp_db():
 
 class TestIsoToUnix:
     """Test ISO timestamp conversion to Unix timestamp"""
+
+    def test_pinboard_format_matches_iso8601(self):
+        for ts in ['1970-01-01T00:00:00Z', '2024-02-29T23:59:59Z', '2038-01-19T03:14:08Z']:
+            assert iso_to_unix(ts) == int(iso8601.parse_date(ts).timestamp())
     
     def test_iso_to_unix_basic(self):
         """Test basic ISO to Unix conversion"""
@@ -230,4 +234,406 @@ class TestAddLinks:
         conn.close()
         
         assert count == 2
-        assert via_result == 'https://www.tbray.org/ongoing/'
\ No newline at end of file
+        assert via_result == 'https://www.tbray.org/ongoing/'
+
+    def test_add_links_single_transaction(self, temp_db):
+        """Test that add_links writes the whole fetch through one batch call"""
+        test_links = [{
+            'ts': 1234567890 + i,
+            'url': f'https://example.com/{i}',
+            'description': f'Test link {i}',
+            'extended': '',
+            'tags': 'python',
+            'hash': f'hash{i}'
+        } for i in range(50)]
+
+        with patch('blogmarks.db.insert_link') as insert_link:
+            count = add_links(test_links)
+
+        insert_link.assert_not_called()
+        assert count['inserted'] == 50
+
+def posts_json(count, start=0):
+    """posts/all's response: a JSON array of posts, one per line"""
+    posts = ',\n'.join(json.dumps({
+        'href': f'https://example.com/{i}', 'description': f'Link {i} & more – “quoted”', 'extended': f'Extended {i}',
+        'meta': 'abc', 'hash': f'hash{i}', 'time': f'2024-01-{1 + i % 28:02d}T10:30:00Z', 'shared': 'yes',
+        'toread': 'no', 'tags': 'python via:waxy'
+    }, ensure_ascii=False) for i in range(start, start + count))
+    return f'[{posts}\n]'.encode('utf-8')
+
+class ChunkedResponse(io.RawIOBase):
+    """An HTTP response arriving in chunks, recording how much has been read"""
+
+    def __init__(self, data, chunk_size=4096):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self.data[self.position:self.position + min(len(buffer), self.chunk_size)]
+        buffer[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+class TestStreamingSync:
+    """Test streaming posts/all into the database"""
+
+    def test_iter_posts(self):
+        links = list(iter_posts(io.BytesIO(posts_json(3))))
+
+        assert [link['hash'] for link in links] == ['hash0', 'hash1', 'hash2']
+        assert links[0] == {
+            'ts': iso_to_unix('2024-01-01T10:30:00Z'),
+            'url': 'https://example.com/0',
+            'description': 'Link 0 & more – “quoted”',
+            'extended': 'Extended 0',
+            'tags': 'python via:waxy',
+            'hash': 'hash0'
+        }
+
+    def test_iter_posts_empty(self):
+        assert list(iter_posts(io.BytesIO(b'[]'))) == []
+
+    def test_iter_posts_across_chunks(self):
+        """Test posts and multibyte characters split between reads"""
+        data = posts_json(50)
+
+        links = list(iter_posts(ChunkedResponse(data, chunk_size=7)))
+
+        assert [link['hash'] for link in links] == [f'hash{i}' for i in range(50)]
+        assert all(link['description'].endswith('“quoted”') for link in links)
+
+    def test_iter_posts_truncated(self):
+        with pytest.raises(json.JSONDecodeError):
+            list(iter_posts(io.BytesIO(posts_json(3)[:-40])))
+
+    def test_posts_yielded_before_response_is_read(self):
+        response = ChunkedResponse(posts_json(2000))
+        posts = iter_posts(response)
+
+        next(posts)
+
+        assert response.position < len(response.data) // 4
+
+    def test_fetch_all_fromdt(self):
+        with patch('blogmarks.pinboard.open_api', return_value=io.BytesIO(posts_json(2))) as open_api:
+            links = list(fetch_all(fromdt=1704067200, tag='mlp'))
+
+        open_api.assert_called_once_with('posts/all', tag='mlp', fromdt='2024-01-01T00:00:00Z')
+        assert len(links) == 2
+
+    def test_sync_all_writes_links(self, temp_db):
+        with patch('blogmarks.pinboard.open_api', return_value=io.BytesIO(posts_json(1200))):
+            counts = sync_all()
+
+        assert counts == {'inserted': 1200, 'updated': 0, 'unchanged': 0}
+        link = next(db.iter_rows(db.module().stream_by_tag(tag='python')))
+        assert link['via'] == 'https://waxy.org/'
+        assert link['tags'] == 'python'
+
+    def test_sync_all_incremental(self, temp_db):
+        with patch('blogmarks.pinboard.open_api', return_value=io.BytesIO(posts_json(5))):
+            sync_all()
+        latest = unix_to_iso(db.module().latest_ts())
+
+        with patch('blogmarks.pinboard.open_api', return_value=io.BytesIO(posts_json(1, start=5))) as open_api:
+            counts = sync_all(incremental=True)
+
+        assert open_api.call_args.kwargs['fromdt'] == latest
+        assert counts['inserted'] == 1
+
+    def test_main_all(self, temp_db, capsys):
+        with patch('blogmarks.pinboard.open_api', return_value=io.BytesIO(posts_json(3))) as open_api:
+            main(['--all'])
+
+        assert open_api.call_args.args == ('posts/all',)
+        assert 'Inserted 3' in capsys.readouterr().out
+
+def post_json(hash_value, day, description=None, tags='mlp'):
+    return {'href': f'https://example.com/{hash_value}', 'description': description or hash_value, 'extended': '',
+            'meta': 'abc', 'hash': hash_value, 'time': f'{day}T12:00:00Z', 'shared': 'yes', 'toread': 'no',
+            'tags': tags}
+
+class FakePinboard:
+    """Stands in for open_api, serving posts from a dict of day -> post JSON"""
+
+    def __init__(self, days, update_time='2024-01-10T00:00:00Z'):
+        self.days = days
+        self.update_time = update_time
+        self.calls = []
+
+    def __call__(self, method, **kwargs):
+        self.calls.append((method, kwargs.get('dt')))
+        if method == 'posts/update':
+            body = {'update_time': self.update_time}
+        elif method == 'posts/dates':
+            body = {'user': 'kellan', 'tag': '', 'dates': {day: str(len(posts)) for day, posts in self.days.items() if posts}}
+        elif method == 'posts/get':
+            body = {'date': kwargs['dt'], 'user': 'kellan', 'posts': self.days.get(kwargs['dt'], [])}
+        elif method == 'posts/recent':
+            body = {'date': self.update_time, 'user': 'kellan',
+                    'posts': [post for day in sorted(self.days, reverse=True) for post in self.days[day]]}
+        else:
+            body = [post for posts in self.days.values() for post in posts]
+        return io.BytesIO(json.dumps(body).encode('utf-8'))
+
+    def fetched_days(self):
+        # days are fetched on several threads, so in no particular order
+        return sorted(day for method, day in self.calls if method == 'posts/get')
+
+class TestReconcile:
+    """Test edit-aware syncing with posts/update, posts/dates and posts/get"""
+
+    @pytest.fixture
+    def pinboard(self, temp_db):
+        pinboard = FakePinboard({f'2024-01-0{day}': [post_json(f'h{day}', f'2024-01-0{day}')] for day in range(1, 10)})
+        with patch('blogmarks.pinboard.open_api', pinboard):
+            sync_all()
+            pinboard.calls.clear()
+            yield pinboard
+
+    def descriptions(self):
+        return {link['hash']: link['description'] for link in db.module().select_recent(count=100)}
+
+    def test_unchanged_days_not_fetched(self, pinboard):
+        counts = reconcile(days=0)
+
+        assert pinboard.fetched_days() == []
+        assert counts == {'inserted': 0, 'updated': 0, 'unchanged': 0, 'forgotten': 0}
+
+    def test_newest_days_refetched(self, pinboard):
+        pinboard.days['2024-01-08'] = [post_json('h8', '2024-01-08', 'Edited')]
+
+        counts = reconcile(days=2)
+
+        assert pinboard.fetched_days() == ['2024-01-08', '2024-01-09']
+        assert counts == {'inserted': 0, 'updated': 1, 'unchanged': 1, 'forgotten': 0}
+        assert self.descriptions()['h8'] == 'Edited'
+
+    def test_days_with_new_count_refetched(self, pinboard):
+        pinboard.days['2024-01-02'].append(post_json('new', '2024-01-02'))
+        pinboard.days['2024-01-03'] = [post_json('h3', '2024-01-03', 'Edited, not found')]
+
+        counts = reconcile(days=0)
+
+        assert pinboard.fetched_days() == ['2024-01-02']
+        assert counts['inserted'] == 1
+        assert self.descriptions()['h3'] == 'h3'
+
+    def test_deleted_bookmark_forgotten(self, pinboard, capsys):
+        pinboard.days['2024-01-04'] = []
+
+        assert reconcile(days=0)['forgotten'] == 1
+        assert 'h4' in capsys.readouterr().out
+        pinboard.calls.clear()
+        reconcile(days=0)
+
+        assert pinboard.fetched_days() == []
+        # left for a person to remove
+        assert 'h4' in self.descriptions()
+
+    def test_backdated_post_recorded_under_pinboard_date(self, pinboard):
+        pinboard.days['2024-01-05'].append(post_json('old', '2024-01-05', tags='mlp date:2020-06-01'))
+
+        reconcile(days=0)
+        pinboard.calls.clear()
+        reconcile(days=0)
+
+        assert pinboard.fetched_days() == []
+
+    def test_nothing_recorded_syncs_everything(self, temp_db):
+        pinboard = FakePinboard({'2024-01-01': [post_json('a', '2024-01-01')]})
+        with patch('blogmarks.pinboard.open_api', pinboard):
+            counts = reconcile()
+
+        assert [method for method, _ in pinboard.calls] == ['posts/all']
+        assert counts['inserted'] == 1
+
+    def test_partly_recorded_syncs_everything(self, temp_db):
+        """Test dates recorded only by recent syncs don't make every older day look changed"""
+        pinboard = FakePinboard({f'2024-01-0{day}': [post_json(f'h{day}', f'2024-01-0{day}')] for day in range(1, 10)})
+        with patch('blogmarks.pinboard.open_api', pinboard):
+            add_links(fetch_recent())
+            pinboard.calls.clear()
+            reconcile()
+
+        assert [method for method, _ in pinboard.calls] == ['posts/all']
+        assert db.module().get_sync_state(name='dates_complete') == '1'
+
+    def test_incremental_sync_leaves_dates_incomplete(self, temp_db):
+        pinboard = FakePinboard({'2024-01-01': [post_json('a', '2024-01-01')]})
+        with patch('blogmarks.pinboard.open_api', pinboard):
+            sync_all(incremental=True)
+
+        assert db.module().get_sync_state(name='dates_complete') is None
+
+class TestSyncRecent:
+    """Test the hourly sync against Pinboard's update time"""
+
+    @pytest.fixture
+    def pinboard(self, temp_db):
+        pinboard = FakePinboard({'2024-01-01': [post_json('a', '2024-01-01')], '2024-01-02': [post_json('b', '2024-01-02')]})
+        with patch('blogmarks.pinboard.open_api', pinboard):
+            yield pinboard
+
+    def methods(self, pinboard):
+        return [method for method, _ in pinboard.calls]
+
+    def test_first_sync_records_update_time(self, pinboard):
+        counts = sync_recent()
+
+        assert counts['inserted'] == 2
+        assert db.module().get_sync_state(name='update_time') == str(iso_to_unix(pinboard.update_time))
+
+    def test_no_change_fetches_nothing(self, pinboard):
+        sync_recent()
+        pinboard.calls.clear()
+
+        sync_recent()
+
+        assert self.methods(pinboard) == ['posts/update']
+
+    def test_backdated_link_does_not_hide_changes(self, pinboard):
+        """Test a date: tag pushing a link's ts past the update time doesn't stop syncs"""
+        pinboard.days['2024-01-02'] = [post_json('b', '2024-01-02', tags='mlp date:2024-06-01')]
+        sync_recent()
+        pinboard.update_time = '2024-01-11T00:00:00Z'
+        pinboard.days['2024-01-03'] = [post_json('c', '2024-01-03')]
+        pinboard.calls.clear()
+
+        counts = sync_recent()
+
+        assert counts['inserted'] == 1
+        assert 'posts/recent' in self.methods(pinboard)
+
+    def changed_later(self, pinboard, day, post):
+        pinboard.update_time = '2024-01-11T00:00:00Z'
+        pinboard.days[day] = [post]
+        pinboard.calls.clear()
+        with patch('blogmarks.pinboard.fetch_recent', return_value=[]):
+            return sync_recent()
+
+    def test_older_edit_reconciled(self, pinboard):
+        sync_all()
+        sync_recent()
+
+        counts = self.changed_later(pinboard, '2024-01-01', post_json('a', '2024-01-01', 'Edited'))
+
+        assert counts['updated'] == 1
+        assert 'posts/dates' in self.methods(pinboard)
+        assert 'posts/all' not in self.methods(pinboard)
+
+    def test_edit_outside_reconciled_days_left_for_full_sync(self, pinboard, capsys):
+        """Test an edit that changes no day's count doesn't start a posts/all download"""
+        pinboard.days.update({f'2023-12-{day}': [post_json(f'd{day}', f'2023-12-{day}')] for day in range(10, 20)})
+        sync_all()
+        sync_recent()
+        capsys.readouterr()
+
+        counts = self.changed_later(pinboard, '2023-12-10', post_json('d10', '2023-12-10', 'Edited'))
+
+        assert 'posts/all' not in self.methods(pinboard)
+        assert counts['updated'] == 0
+        assert '--all' in capsys.readouterr().out
+        assert db.module().get_sync_state(name='update_time') == str(iso_to_unix('2024-01-11T00:00:00Z'))
+        assert sync_all()['updated'] == 1
+
+    def test_change_outside_tag_fetches_no_archive(self, pinboard):
+        """Test a bookmark outside the synced tag moving the update time costs no posts/all"""
+        sync_all(tag='mlp')
+        sync_recent(tag='mlp')
+        pinboard.update_time = '2024-01-11T00:00:00Z'
+        pinboard.calls.clear()
+
+        counts = sync_recent(tag='mlp')
+
+        assert 'posts/all' not in self.methods(pinboard)
+        assert not counts['inserted'] and not counts['updated']
+
+    def test_change_before_full_sync_uses_posts_all(self, pinboard):
+        """Test the dates recent syncs recorded aren't taken for all of them"""
+        sync_recent()
+
+        counts = self.changed_later(pinboard, '2024-01-01', post_json('a', '2024-01-01', 'Edited'))
+
+        assert 'posts/dates' not in self.methods(pinboard)
+        assert counts['updated'] == 1
+        assert db.module().get_sync_state(name='dates_complete') == '1'
+
+class TestConcurrentFetch:
+    """Test fetching many days at once under the shared rate limiter"""
+
+    @pytest.fixture
+    def pinboard(self, temp_db):
+        pinboard = FakePinboard({f'2024-01-{day:02}': [post_json(f'h{day}', f'2024-01-{day:02}')]
+                                 for day in range(1, 21)})
+        with patch('blogmarks.pinboard.open_api', pinboard):
+            yield pinboard
+
+    def test_fetch_days_in_order(self, pinboard):
+        days = [f'2024-01-{day:02}' for day in range(1, 23)]
+        remote = {day: 1 for day in days[:20]}
+
+        fetched = list(fetch_days(days, remote, jobs=4))
+
+        assert [day for day, _ in fetched] == days
+        assert [link['hash'] for _, links in fetched for link in links] == [f'h{day}' for day in range(1, 21)]
+        # days posts/dates has nothing for aren't asked for
+        assert len(pinboard.fetched_days()) == 20
+
+    def test_sync_range(self, pinboard, capsys):
+        counts = sync_range('2024-01-05', '2024-01-14')
+
+        assert pinboard.fetched_days() == [f'2024-01-{day:02}' for day in range(5, 15)]
+        assert counts == {'inserted': 10, 'updated': 0, 'unchanged': 0}
+        assert [row['day'] for row in db.module().post_date_counts()][0] == '2024-01-05'
+
+    def test_main_range(self, pinboard, capsys):
+        main(['--range', '2024-01-01', '2024-01-03'])
+
+        assert 'Inserted 3' in capsys.readouterr().out
+
+class TestRateLimitState:
+    """Test the rate limiter's last calls carrying over between runs"""
+
+    @pytest.fixture(autouse=True)
+    def no_client(self, temp_db, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        pinboard_module.client = None
+        yield
+        pinboard_module.client = None
+
+    def test_saved_and_restored(self):
+        pinboard_module.api_client().limiter.last_calls['posts/all'] = 1700000000.0
+        pinboard_module.save_rate_limits()
+        pinboard_module.client = None
+
+        assert pinboard_module.api_client().limiter.last_calls == {'posts/all': 1700000000.0}
+
+    def test_nothing_saved_without_calls(self):
+        pinboard_module.save_rate_limits()
+
+        assert not os.path.exists(pinboard_module.RATE_LIMITS_PATH)
+
+    def test_unchanged_sync_leaves_database_alone(self, temp_db):
+        """Test an hourly run that finds nothing new doesn't rewrite data.db"""
+        pinboard = FakePinboard({'2024-01-01': [post_json('a', '2024-01-01')]})
+
+        def open_api(method, **kwargs):
+            pinboard_module.api_client().limiter.last_calls[method] = time.time()
+            return pinboard(method, **kwargs)
+
+        with patch('blogmarks.pinboard.open_api', open_api):
+            main([])
+            with open(temp_db, 'rb') as fp:
+                before = fp.read()
+            main([])
+            with open(temp_db, 'rb') as fp:
+                after = fp.read()
+
+        assert before == after
+        assert os.path.exists(pinboard_module.RATE_LIMITS_PATH)
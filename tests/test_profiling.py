@@ -0,0 +1,164 @@
+# ABOUTME: Test suite for render --profile build reports
+# ABOUTME: Tests statement and template timing, stage counts, pool workers' timings and the cProfile dump
+import pytest
+import tempfile
+import json
+import os
+import time
+import pugsql
+from blogmarks import db, output, profiling
+from blogmarks import render as render_module
+
+@pytest.fixture
+def temp_db():
+    """Create a temporary database for testing"""
+    temp_fd, temp_path = tempfile.mkstemp(suffix='.db')
+    os.close(temp_fd)
+
+    # Override the db module to use temp database
+    original_module_func = db.module
+    queries = db.connect(f'sqlite:///{temp_path}')
+    db.module = lambda: queries
+
+    yield temp_path
+
+    # Cleanup
+    db.module = original_module_func
+    os.unlink(temp_path)
+
+@pytest.fixture(autouse=True)
+def reset_profiling():
+    yield
+    profiling.current = None
+    output.stats.clear()
+
+def make_links(count):
+    return [{
+        'ts': 1704067200 + i * 10 * 86400,
+        'url': f'https://example.com/{i}',
+        'description': f'Link {i}',
+        'extended': '',
+        'via': None,
+        'tags': 'python' if i % 2 else 'python sqlite',
+        'hash': f'hash{i}'
+    } for i in range(count)]
+
+class TestProfile:
+    """Test statement and template timing"""
+
+    def test_statements_timed_and_restored(self, temp_db):
+        db.insert_links(make_links(5))
+        queries = db.module()
+
+        profiling.start(queries)
+        rows = list(db.iter_rows(queries.stream_links()))
+        queries.select_recent(count=2)
+        report = profiling.stop(queries)
+
+        assert len(rows) == 5
+        counts = {q['statement']: q for q in report['queries']}
+        assert counts['stream_links']['calls'] == 1
+        assert counts['stream_links']['rows'] == 5
+        assert counts['select_recent']['calls'] == 1
+        assert isinstance(queries.stream_links, pugsql.statement.Statement)
+        assert profiling.current is None
+
+    def test_template_time_leaves_out_queries(self):
+        profile = profiling.Profile()
+
+        def chunks():
+            # a template pulling a row off a slow cursor
+            time.sleep(0.2)
+            profile.add_query('slow', 0.2, rows=1)
+            yield 'a'
+            yield 'b'
+
+        assert ''.join(profile.time_template('page.html', chunks())) == 'ab'
+        assert profile.templates['page.html']['renders'] == 1
+        assert profile.templates['page.html']['seconds'] < 0.1
+
+    def test_take_and_merge(self):
+        worker = profiling.Profile()
+        worker.add_query('stream_by_tag', 0.5, calls=1, rows=3)
+        profile = profiling.Profile()
+        profile.add_query('stream_by_tag', 0.25, calls=1, rows=1)
+
+        profile.merge(worker.take())
+
+        assert profile.queries['stream_by_tag'] == {'calls': 2, 'rows': 4, 'seconds': 0.75}
+        assert worker.queries == {}
+
+    def test_stage_counts_outputs(self, tmp_path):
+        profiling.current = profiling.Profile()
+
+        with profiling.stage('write'):
+            output.write_file(str(tmp_path / 'a.html'), 'hello')
+            output.write_file(str(tmp_path / 'a.html'), 'hello')
+
+        [stage] = profiling.current.stages
+        assert stage['stage'] == 'write'
+        assert (stage['written'], stage['skipped'], stage['bytes']) == (1, 1, 5)
+
+    def test_stage_without_profile(self):
+        with profiling.stage('anything'):
+            pass
+
+        assert profiling.current is None
+
+class TestRenderProfile:
+    """Test render.main --profile and --cprofile"""
+
+    @pytest.fixture
+    def build(self, temp_db, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        os.symlink(os.path.join(os.path.dirname(__file__), '..', 'templates'), tmp_path / 'templates')
+        db.insert_links(make_links(30))
+        return tmp_path
+
+    def read_report(self, build):
+        with open(build / profiling.REPORT_PATH) as fp:
+            return json.load(fp)
+
+    def test_profile_report(self, build, capsys):
+        render_module.main(['--profile', '--page-size', '10'])
+
+        report = self.read_report(build)
+        stages = {s['stage']: s for s in report['stages']}
+        assert list(stages) == ['state', 'snapshot', 'index', 'archives', 'tags', 'feed', 'recent json', 'manifest', 'compress']
+        # index.html and pages 1-3
+        assert stages['index']['written'] == 4
+        assert sum(s['written'] for s in report['stages']) == output.stats['written']
+        statements = {q['statement']: q for q in report['queries']}
+        assert statements['stream_links']['rows'] == 30
+        assert statements['stream_page']['calls'] == 3
+        assert statements['stream_by_tag']['calls'] == 2
+        templates = {t['template']: t for t in report['templates']}
+        assert templates['atom.xml']['renders'] == 3
+        assert 'functions' not in report
+        assert 'stream_by_tag' in capsys.readouterr().out
+        assert profiling.current is None
+
+    def test_pool_workers_timings_merged(self, build):
+        render_module.main(['--profile', '--jobs', '2'])
+
+        report = self.read_report(build)
+        statements = {q['statement']: q for q in report['queries']}
+        assert statements['stream_by_year_month']['calls'] == 10
+        templates = {t['template']: t for t in report['templates']}
+        # index.html, every month and both tags' first pages
+        assert templates['links.html']['renders'] == 1 + 10 + 2
+
+    def test_cprofile(self, build):
+        render_module.main(['--cprofile'])
+
+        report = self.read_report(build)
+        assert len(report['functions']) == profiling.FUNCTION_COUNT
+        # build_site runs the whole build, so its cumulative time tops any stage's
+        assert any('build_site' in f['function'] for f in report['functions'])
+        assert os.path.exists(build / profiling.STATS_PATH)
+
+    def test_plain_build_not_profiled(self, build):
+        render_module.main([])
+
+        assert not os.path.exists(build / profiling.REPORT_PATH)
+        assert isinstance(db.module().stream_links, pugsql.statement.Statement)
@@ -8,9 +8,6 @@ from blogmarks.render import create_recent_json
 from blogmarks import db
 
 
-BLOGMARKS_ROOT = os.path.join(os.path.dirname(__file__), '..')
-
-
 @pytest.fixture
 def temp_db():
     """Create a temporary database for testing"""
@@ -19,16 +16,8 @@ def temp_db():
 
     # Override the db module to use temp database
     original_module_func = db.module
-    sql_dir = os.path.join(BLOGMARKS_ROOT, 'sql/')
-
-    def temp_module():
-        import pugsql
-        queries = pugsql.module(sql_dir)
-        queries.connect(f'sqlite:///{temp_path}')
-        queries.create_links_tables()
-        return queries
-
-    db.module = temp_module
+    queries = db.connect(f'sqlite:///{temp_path}')
+    db.module = lambda: queries
 
     yield temp_path
 
@@ -4,7 +4,10 @@ import pytest
 import tempfile
 import os
 import sqlite3
-from blogmarks.render import format_ts, format_ts_rfc3339, link_tags, prepare_posts, render
+import subprocess
+import sys
+from blogmarks.render import format_ts, format_ts_rfc3339, link_tags, prepare_posts, render, load_snapshot, make_env
+from blogmarks import render as render_module
 from blogmarks import db
 import datetime
 from unittest.mock import patch, MagicMock
@@ -17,13 +20,8 @@ def temp_db():
     
     # Override the db module to use temp database
     original_module_func = db.module
-    def temp_module():
-        queries = original_module_func()
-        queries.connect(f'sqlite:///{temp_path}')
-        queries.create_links_tables()
-        return queries
-    
-    db.module = temp_module
+    queries = db.connect(f'sqlite:///{temp_path}')
+    db.module = lambda: queries
     
     yield temp_path
     
@@ -248,6 +246,464 @@ class TestRender:
             
             mock_template.render.assert_called_once_with(test_data)
 
+class TestTemplateCache:
+    """Test the compiled template bytecode cache"""
+
+    @pytest.fixture
+    def templates(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        os.mkdir('templates')
+        with open('templates/page.html', 'w') as fp:
+            fp.write('<p>{{ ts|format_ts }}</p>')
+        return tmp_path
+
+    def test_compiled_templates_are_cached(self, templates):
+        env = make_env(cache_path='cache')
+        env.get_template('page.html')
+
+        assert len(os.listdir('cache')) == 1
+
+    def test_cached_template_renders_same(self, templates):
+        first = make_env(cache_path='cache').get_template('page.html').render(ts=1234567890)
+        with patch('jinja2.environment.Environment._compile', side_effect=AssertionError('recompiled')):
+            second = make_env(cache_path='cache').get_template('page.html').render(ts=1234567890)
+
+        assert first == second
+
+    def test_edited_template_is_recompiled(self, templates):
+        make_env(cache_path='cache').get_template('page.html')
+        with open('templates/page.html', 'w') as fp:
+            fp.write('<div>{{ ts|format_ts }}</div>')
+
+        result = make_env(cache_path='cache').get_template('page.html').render(ts=1234567890)
+
+        assert result.startswith('<div>')
+
+    def test_cache_can_be_disabled(self, templates):
+        env = make_env(cache_path=None)
+
+        assert env.bytecode_cache is None
+        assert env.get_template('page.html').render(ts=1234567890).startswith('<p>')
+
+    def test_import_leaves_disk_alone(self, tmp_path):
+        """Test importing render, or search for its dates, creates no cache directory"""
+        root = os.path.join(os.path.dirname(__file__), '..')
+        subprocess.run([sys.executable, '-c', 'import blogmarks.render, blogmarks.search'], cwd=tmp_path, check=True,
+                       env={**os.environ, 'PYTHONPATH': os.path.abspath(root)})
+
+        assert os.listdir(tmp_path) == []
+
+    def test_build_caches_templates(self, temp_db, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        os.symlink(os.path.join(os.path.dirname(__file__), '..', 'templates'), tmp_path / 'templates')
+
+        render_module.main([])
+
+        assert os.listdir(render_module.TEMPLATE_CACHE_PATH)
+
+class TestSnapshot:
+    """Test the single read snapshot every output renders from"""
+
+    def insert(self, links):
+        db.insert_links([{
+            'ts': ts,
+            'url': f'https://example.com/{hash_value}',
+            'description': hash_value,
+            'extended': '',
+            'via': None,
+            'tags': tags,
+            'hash': hash_value
+        } for ts, hash_value, tags in links])
+
+    def test_snapshot_groups_by_month(self, temp_db):
+        """Test recent links are newest first and months are in calendar order"""
+        self.insert([
+            (1704067200, 'jan', 'python'),  # 2024-01-01 00:00 UTC
+            (1706745599, 'jan_end', 'python quotable'),  # 2024-01-31 23:59:59 UTC
+            (1706745600, 'feb', 'coding'),  # 2024-02-01 00:00 UTC
+            (1672531200, 'old', ''),  # 2023-01-01 UTC
+        ])
+
+        snapshot = load_snapshot()
+
+        assert [l['hash'] for l in snapshot['links']] == ['feb', 'jan_end', 'jan', 'old']
+        assert list(snapshot['months']) == ['2023-01', '2024-01', '2024-02']
+        assert snapshot['links'][1]['quotable'] is True
+        assert snapshot['links'][0]['clean_tags'] == ['coding']
+
+    def test_snapshot_keeps_only_recent_links(self, temp_db):
+        """Test the snapshot holds count links however large the archive is"""
+        self.insert([(1704067200 + i * 3 * 86400, f'h{i}', 'test') for i in range(40)])
+
+        snapshot = load_snapshot(count=5)
+
+        assert [l['hash'] for l in snapshot['links']] == ['h39', 'h38', 'h37', 'h36', 'h35']
+        assert len(snapshot['months']) == 4
+
+    def test_month_fingerprint_follows_its_links(self, temp_db):
+        """Test editing a link changes its month's fingerprint and no other"""
+        self.insert([
+            (1704153600, 'jan', 'test'),  # 2024-01-02
+            (1706832000, 'feb', 'test'),  # 2024-02-02
+        ])
+        before = load_snapshot()['months']
+
+        self.insert([(1704153600, 'jan', 'test edited')])
+        after = load_snapshot()['months']
+
+        assert after['2024-01'] != before['2024-01']
+        assert after['2024-02'] == before['2024-02']
+
+    def test_render_month_streams_rows(self, temp_db):
+        """Test a month page renders from rows streamed off the cursor"""
+        self.insert([(1704067200 + i * 3600, f'h{i}', 'test') for i in range(5)])
+
+        chunks = render_module.render_month(db.module(), '2024-01')
+
+        assert not isinstance(chunks, str)
+        page = ''.join(chunks)
+        assert page.index('example.com/h4') < page.index('example.com/h0')
+        assert 'Archive: 2024-01' in page
+
+    def test_main_reads_links_once(self, temp_db, tmp_path, monkeypatch):
+        """Test a build makes one pass over links, and a forced no-op rebuild nothing more"""
+        self.insert([(1704067200 + i * 86400, f'h{i}', 'test') for i in range(5)])
+        queries = db.module()
+        monkeypatch.chdir(tmp_path)
+        os.symlink(os.path.join(os.path.dirname(__file__), '..', 'templates'), tmp_path / 'templates')
+        render_module.main([])
+
+        with patch.object(queries, 'stream_links', wraps=queries.stream_links) as stream_links, \
+                patch.object(queries, 'stream_by_year_month') as stream_by_year_month, \
+                patch.object(queries, 'select_recent') as select_recent:
+            render_module.main(['--force'])
+
+        assert stream_links.call_count == 1
+        stream_by_year_month.assert_not_called()
+        select_recent.assert_not_called()
+        assert (tmp_path / '_site' / 'index.html').exists()
+        assert (tmp_path / '_site' / '2024-01.html').exists()
+
+class TestPagination:
+    """Test index.html, page/2.html, ... and their keyset queries"""
+
+    def insert(self, count, ts=1704067200):
+        db.insert_links([{
+            'ts': ts + i * 3600,
+            'url': f'https://example.com/{i}',
+            'description': f'Link {i}',
+            'extended': '',
+            'via': None,
+            'tags': 'test',
+            'hash': f'h{i}'
+        } for i in range(count)])
+
+    @pytest.fixture
+    def site(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        os.symlink(os.path.join(os.path.dirname(__file__), '..', 'templates'), tmp_path / 'templates')
+        return tmp_path / '_site'
+
+    def test_snapshot_pages(self, temp_db):
+        """Test pages are cut from the oldest link, so only the newest is short"""
+        self.insert(7)
+
+        snapshot = load_snapshot(page_size=3)
+        pages = snapshot['pages']
+
+        assert snapshot['count'] == 7
+        assert [page['count'] for page in pages] == [3, 3, 1]
+        oldest = list(db.module().select_recent(count=7))[::-1]
+        assert [page['newest'] for page in pages] == [[oldest[i]['ts'], oldest[i]['id']] for i in (2, 5, 6)]
+        assert snapshot['front'] == [pages[1]['digest'], pages[2]['digest']]
+
+    def test_stream_page_starts_at_keyset(self, temp_db):
+        """Test links sharing a timestamp are split across pages without gaps or repeats"""
+        self.insert(5)
+        self.insert(4, ts=1704067200 + 2 * 3600)  # second batch collides on ts
+        queries = db.module()
+        every = [r['hash'] for r in db.iter_rows(queries.stream_links())]
+
+        seen = []
+        for page in reversed(load_snapshot(page_size=2)['pages']):
+            rows = db.iter_rows(queries.stream_page(ts=page['newest'][0], id=page['newest'][1], count=page['count']))
+            seen += [r['hash'] for r in rows]
+
+        assert seen == every[::-1]
+
+    def test_pages_written_with_nav(self, temp_db, site):
+        self.insert(7)
+
+        render_module.main(['--page-size', '3'])
+
+        index = (site / 'index.html').read_text()
+        first = (site / 'page' / '1.html').read_text()
+        second = (site / 'page' / '2.html').read_text()
+        third = (site / 'page' / '3.html').read_text()
+        assert index.count('<article') == 3 and third.count('<article') == 1
+        assert 'example.com/6"' in index and 'example.com/4"' in index
+        assert 'example.com/0"' in first and 'example.com/3"' in second and 'example.com/6"' in third
+        # the front page carries on from the page holding link 3
+        assert 'href="page/2.html">older' in index and 'newer' not in index
+        assert 'href="../page/3.html">&larr; newer' in second and 'href="../page/1.html">older' in second
+        assert 'href="../index.html">&larr; newer' in third
+        assert 'older' not in first
+        assert 'href="../archive.html"' in third
+        assert not (site / 'page' / '4.html').exists()
+
+    def test_no_numbered_pages_while_front_page_holds_everything(self, temp_db, site):
+        self.insert(3)
+
+        render_module.main(['--page-size', '3'])
+
+        assert 'pagination' not in (site / 'index.html').read_text()
+        assert not (site / 'page').exists()
+
+    def test_months_have_no_nav(self, temp_db, site):
+        self.insert(7)
+
+        render_module.main(['--page-size', '3'])
+
+        assert 'pagination' not in (site / '2024-01.html').read_text()
+
+    def touch_pages(self, site):
+        for path in (site / 'index.html', site / 'page' / '1.html', site / 'page' / '2.html', site / 'page' / '3.html'):
+            os.utime(path, ns=(1, 1))
+
+    def rewritten(self, site):
+        return sorted(str(path.relative_to(site)) for path in [site / 'index.html', *site.glob('page/*.html')]
+                      if os.stat(path).st_mtime_ns != 1)
+
+    def test_edit_rewrites_only_its_page(self, temp_db, site):
+        self.insert(7)
+        render_module.main(['--page-size', '3'])
+        self.touch_pages(site)
+
+        db.insert_links([{
+            'ts': 1704067200 + 2 * 3600,
+            'url': 'https://example.com/2',
+            'description': 'Edited',
+            'extended': '',
+            'via': None,
+            'tags': 'test',
+            'hash': 'h2'
+        }])
+        render_module.main(['--page-size', '3'])
+
+        assert self.rewritten(site) == ['page/1.html']
+        assert 'Edited' in (site / 'page' / '1.html').read_text()
+
+    def test_new_link_rewrites_front_and_newest_page(self, temp_db, site):
+        self.insert(7)
+        render_module.main(['--page-size', '3'])
+        self.touch_pages(site)
+
+        self.insert(8)
+        render_module.main(['--page-size', '3'])
+
+        assert self.rewritten(site) == ['index.html', 'page/3.html']
+        assert 'example.com/7"' in (site / 'page' / '3.html').read_text()
+
+class TestTagPages:
+    """Test tag/<tag>.html, tag/<tag>.atom and tags.html"""
+
+    def insert(self, links):
+        db.insert_links([{
+            'ts': ts,
+            'url': f'https://example.com/{hash_value}',
+            'description': description,
+            'extended': '',
+            'via': None,
+            'tags': tags,
+            'hash': hash_value
+        } for ts, hash_value, tags, description in links])
+
+    @pytest.fixture
+    def site(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        os.symlink(os.path.join(os.path.dirname(__file__), '..', 'templates'), tmp_path / 'templates')
+        return tmp_path / '_site'
+
+    def test_snapshot_tags(self, temp_db):
+        self.insert([(1704067200 + i, f'h{i}', 'python' if i % 2 else 'python climate', f'Link {i}')
+                     for i in range(5)])
+
+        tags = load_snapshot(page_size=2)['tags']
+
+        assert list(tags) == ['climate', 'python']
+        assert tags['python']['count'] == 5
+        assert len(tags['python']['pages']) == 3
+        assert tags['climate']['count'] == 3
+        assert len(tags['climate']['pages']) == 2
+
+    def test_tag_title_escaped(self, temp_db, site):
+        self.insert([(1704067200, 'b', '<b>', 'Bold')])
+
+        render_module.main([])
+
+        page = (site / 'tag' / '<b>.html').read_text()
+        assert '<h1>Tagged &lt;b&gt;</h1>' in page
+        assert '<h1>Tagged <b>' not in page
+
+    def test_tag_outputs(self, temp_db, site):
+        self.insert([(1704067200 + i, f'h{i}', 'python', f'Link {i}') for i in range(3)]
+                    + [(1704067300, 'c', 'climate-hope', 'Wetlands')])
+
+        render_module.main(['--page-size', '2'])
+
+        front = (site / 'tag' / 'python.html').read_text()
+        first = (site / 'tag' / 'python' / '1.html').read_text()
+        second = (site / 'tag' / 'python' / '2.html').read_text()
+        assert 'Tagged python' in front
+        assert 'Link 2' in front and 'Link 1' in front and 'Link 0' not in front
+        assert 'Link 0' in first and 'Link 1' in first and 'Tagged python, page 1' in first
+        assert 'Link 2' in second and 'Link 1' not in second
+        assert 'href="../tag/python/1.html">older' in front
+        assert 'href="../../tag/python/2.html">&larr; newer' in first
+        assert 'href="../../tag/python.html">&larr; newer' in second
+        assert 'href="../../tag/python/1.html">older' in second
+        assert 'href="../../archive.html"' in second
+        assert 'Wetlands' not in front
+        assert not (site / 'tag' / 'climate-hope').exists()
+
+        feed = (site / 'tag' / 'python.atom').read_text()
+        assert 'Linkblog: python</title>' in feed
+        assert 'https://laughingmeme.org/links/tag/python.html' in feed
+        assert feed.count('<entry>') == 3
+
+        tags = (site / 'tags.html').read_text()
+        assert tags.index('tag/python.html') < tags.index('tag/climate-hope.html')
+
+    def test_main_feed_unchanged(self, temp_db, site):
+        """Test index.atom keeps the site wide title and links"""
+        self.insert([(1704067200, 'a', 'python', 'Link')])
+
+        render_module.main([])
+
+        feed = (site / 'index.atom').read_text()
+        assert '<link href="https://laughingmeme.org/links/" />' in feed
+        assert '<title>Kellan Elliott-McCrea&apos;s Linkblog</title>' in feed
+
+    def test_only_touched_tags_rerendered(self, temp_db, site):
+        self.insert([
+            (1704067200, 'a', 'python', 'Python link'),
+            (1704067201, 'b', 'climate', 'Climate link'),
+        ])
+        render_module.main([])
+        queries = db.module()
+
+        self.insert([(1704067200, 'a', 'python', 'Python link, edited')])
+        with patch.object(queries, 'stream_by_tag', wraps=queries.stream_by_tag) as stream_by_tag:
+            render_module.main([])
+
+        assert [c.kwargs['tag'] for c in stream_by_tag.call_args_list] == ['python']
+        assert 'edited' in (site / 'tag' / 'python.html').read_text()
+
+    def test_retag_touches_old_and_new_tag(self, temp_db, site):
+        self.insert([
+            (1704067200, 'a', 'python', 'Link a'),
+            (1704067201, 'b', 'python climate', 'Link b'),
+        ])
+        render_module.main([])
+        queries = db.module()
+
+        self.insert([(1704067200, 'a', 'climate', 'Link a')])
+        with patch.object(queries, 'stream_by_tag', wraps=queries.stream_by_tag) as stream_by_tag:
+            render_module.main([])
+
+        assert sorted(c.kwargs['tag'] for c in stream_by_tag.call_args_list) == ['climate', 'python']
+        assert 'Link a' not in (site / 'tag' / 'python.html').read_text()
+        assert 'Link a' in (site / 'tag' / 'climate.html').read_text()
+
+    def test_new_link_rewrites_tag_front_and_newest_page(self, temp_db, site):
+        self.insert([(1704067200 + i, f'h{i}', 'mlp', f'Link {i}') for i in range(7)])
+        render_module.main(['--page-size', '3'])
+        for path in site.glob('tag/mlp*/**/*.html'):
+            os.utime(path, ns=(1, 1))
+        os.utime(site / 'tag' / 'mlp.html', ns=(1, 1))
+
+        self.insert([(1704067300, 'new', 'mlp', 'New link')])
+        render_module.main(['--page-size', '3'])
+
+        rewritten = sorted(str(path.relative_to(site)) for path in [site / 'tag' / 'mlp.html', *site.glob('tag/mlp/*.html')]
+                           if os.stat(path).st_mtime_ns != 1)
+        assert rewritten == ['tag/mlp.html', 'tag/mlp/3.html']
+        assert 'New link' in (site / 'tag' / 'mlp' / '3.html').read_text()
+
+    def test_tag_filenames(self):
+        assert render_module.tag_page_path('sun.ra') == 'tag/sun.ra.html'
+        assert render_module.tag_page_path('a/b', 2) == 'tag/a%2Fb/2.html'
+        assert render_module.tag_feed_path('..') == 'tag/%2E..atom'
+        assert render_module.tag_feed_path('100%') == 'tag/100%25.atom'
+
+    def test_tag_with_slash_is_linked_escaped(self, temp_db, site):
+        self.insert([(1704067200, 'a', 'a/b 🔬', 'Link')])
+
+        render_module.main([])
+
+        assert (site / 'tag' / 'a%2Fb.html').exists()
+        assert (site / 'tag' / '🔬.html').exists()
+        tags = (site / 'tags.html').read_text()
+        assert 'href="tag/a%252Fb.html"' in tags
+        assert 'href="tag/%F0%9F%94%AC.html"' in tags
+
+class TestParallelRender:
+    """Test rendering archive months across a worker pool"""
+
+    def build(self, root, argv):
+        os.makedirs(root)
+        os.symlink(os.path.join(os.path.dirname(__file__), '..', 'templates'), os.path.join(root, 'templates'))
+        cwd = os.getcwd()
+        os.chdir(root)
+        try:
+            render_module.main(argv)
+        finally:
+            os.chdir(cwd)
+        site = os.path.join(root, '_site')
+        contents = {}
+        for directory, _, names in os.walk(site):
+            for name in names:
+                path = os.path.join(directory, name)
+                with open(path, 'rb') as fp:
+                    contents[os.path.relpath(path, site)] = fp.read()
+        return contents
+
+    def test_parallel_output_matches_serial(self, temp_db, tmp_path):
+        """Test --jobs output is byte-identical to the serial build"""
+        db.insert_links([{
+            'ts': 1704067200 + i * 2 * 86400 + (i % 3),
+            'url': f'https://example.com/{i}',
+            'description': f'Link {i}',
+            'extended': f'Extended {i}',
+            'via': 'https://waxy.org/' if i % 5 == 0 else None,
+            'tags': 'python quotable' if i % 4 == 0 else 'python',
+            'hash': f'hash{i}'
+        } for i in range(150)])
+
+        serial = self.build(str(tmp_path / 'serial'), [])
+        parallel = self.build(str(tmp_path / 'parallel'), ['--jobs', '3'])
+
+        assert len([name for name in serial if name.startswith('2024-')]) > 5
+        assert serial == parallel
+
+    def test_parallel_counts_worker_writes(self, temp_db, tmp_path, capsys):
+        """Test files written in workers are counted in the build summary"""
+        db.insert_links([{
+            'ts': 1704067200 + i * 40 * 86400,
+            'url': f'https://example.com/{i}',
+            'description': f'Link {i}',
+            'extended': '',
+            'via': None,
+            'tags': 'python',
+            'hash': f'hash{i}'
+        } for i in range(4)])
+
+        self.build(str(tmp_path / 'parallel'), ['--jobs', '2'])
+
+        # 4 months, archive, index, feed, recent json, the python tag's
+        # page and feed, tags.html, the manifest and the build state
+        assert 'Wrote 13 files' in capsys.readouterr().out
+
 # Integration tests for file generation functions would require more complex setup
 # and file system mocking, which may be beyond the scope of this comprehensive test suite.
 # The core logic functions are well covered above.
\ No newline at end of file
@@ -0,0 +1,145 @@
+# ABOUTME: Test suite for full text search over links
+# ABOUTME: Tests FTS query building, index sync through upserts, ranking and the CLI
+import pytest
+import tempfile
+import os
+import sqlite3
+from blogmarks import db
+from blogmarks.search import fts_query, search, main
+
+@pytest.fixture
+def temp_db():
+    """Create a temporary database for testing"""
+    temp_fd, temp_path = tempfile.mkstemp(suffix='.db')
+    os.close(temp_fd)
+
+    # Override the db module to use temp database
+    original_module_func = db.module
+    queries = db.connect(f'sqlite:///{temp_path}')
+    db.module = lambda: queries
+
+    yield temp_path
+
+    # Cleanup
+    db.module = original_module_func
+    os.unlink(temp_path)
+
+def make_link(hash_value, description, extended='', tags='', via=None, ts=1234567890):
+    return {
+        'ts': ts,
+        'url': f'https://example.com/{hash_value}',
+        'description': description,
+        'extended': extended,
+        'via': via,
+        'tags': tags,
+        'hash': hash_value
+    }
+
+class TestFtsQuery:
+    """Test free text to FTS5 query conversion"""
+
+    def test_quotes_each_word(self):
+        assert fts_query('climate hope') == '"climate" "hope"'
+
+    def test_punctuation_is_literal(self):
+        assert fts_query('c++ "quoted"') == '"c++" """quoted"""'
+
+    def test_prefix(self):
+        assert fts_query('clim*') == '"clim"*'
+
+    def test_blank(self):
+        assert fts_query('   ') == ''
+
+class TestSearch:
+    """Test searching the links_fts index"""
+
+    def test_matches_every_indexed_column(self, temp_db):
+        db.insert_links([
+            make_link('desc', 'Heat pumps explained'),
+            make_link('ext', 'Something', extended='all about heat pumps'),
+            make_link('tags', 'Other', tags='heatpumps energy'),
+            make_link('via', 'Another', via='https://heatpumps.example.com/'),
+        ])
+
+        assert [r['hash'] for r in search('explained')] == ['desc']
+        assert [r['hash'] for r in search('about')] == ['ext']
+        assert [r['hash'] for r in search('energy')] == ['tags']
+        assert {r['hash'] for r in search('heatpumps')} == {'tags', 'via'}
+
+    def test_description_ranks_above_extended(self, temp_db):
+        db.insert_links([
+            make_link('ext', 'Unrelated title', extended='a long piece that mentions solar once'),
+            make_link('desc', 'Solar power'),
+        ])
+
+        assert [r['hash'] for r in search('solar')] == ['desc', 'ext']
+
+    def test_snippet_marks_match(self, temp_db):
+        db.insert_links([make_link('a', 'Batteries for the grid')])
+
+        results = search('grid', start='[', end=']')
+
+        assert '[grid]' in results[0]['snippet']
+
+    def test_index_follows_edits(self, temp_db):
+        db.insert_links([make_link('a', 'Original wording')])
+        db.insert_links([make_link('a', 'Revised wording')])
+
+        assert search('original') == []
+        assert [r['hash'] for r in search('revised')] == ['a']
+
+    def test_index_follows_direct_updates(self, temp_db):
+        db.insert_links([make_link('a', 'Some link')])
+
+        conn = sqlite3.connect(temp_db)
+        conn.execute("UPDATE links SET via = 'https://waxy.org/' WHERE hash = 'a'")
+        conn.commit()
+        conn.close()
+
+        assert [r['hash'] for r in search('waxy')] == ['a']
+
+    def test_count_limits_results(self, temp_db):
+        db.insert_links([make_link(f'h{i}', f'Link {i} about rivers') for i in range(5)])
+
+        assert len(search('rivers', count=2)) == 2
+
+    def test_punctuation_does_not_raise(self, temp_db):
+        db.insert_links([make_link('a', 'Plain link')])
+
+        assert search('AND OR ( "') == []
+
+    def test_blank_query(self, temp_db):
+        assert search('') == []
+
+    def test_existing_links_indexed(self, tmp_path):
+        """Test that opening an older database builds the index for its rows"""
+        path = tmp_path / 'old.db'
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE links (id integer primary key autoincrement, ts integer, url text, "
+            "description text, extended text, via text, tags text, hash text unique)")
+        conn.execute(
+            "INSERT INTO links (ts, url, description, extended, via, tags, hash) "
+            "VALUES (1, 'https://example.com', 'Wetlands restoration', '', NULL, 'climate', 'old')")
+        conn.commit()
+        conn.close()
+
+        queries = db.connect(f'sqlite:///{path}')
+        results = list(queries.search_links(query='"wetlands"', count=10, start='', end=''))
+
+        assert [r['hash'] for r in results] == ['old']
+
+class TestMain:
+    """Test the command line entry point"""
+
+    def test_main_prints_results(self, temp_db, monkeypatch, capsys):
+        db.insert_links([make_link('a', 'Rewilding rivers', ts=1704067200)])
+        monkeypatch.setattr('sys.argv', ['search', 'rivers'])
+
+        main()
+
+        out = capsys.readouterr().out
+        assert 'Rewilding rivers' in out
+        assert 'https://example.com/a' in out
+        assert '[rivers]' in out
+        assert '1 results' in out